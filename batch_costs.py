@@ -0,0 +1,167 @@
+import numpy as np # type: ignore
+from typing import Any, Dict, List, Optional
+
+
+from compiled_pack import CompiledPack
+
+
+INT64_MAX = np.iinfo(np.int64).max
+"""Largest value that fits in an int64 matrix, anything bigger falls back to Python integers."""
+
+
+class BatchResult:
+    """BatchResult holds the results of evaluating many orders at once. Row i of each matrix belongs to order i, column j belongs to the item with id j in the CompiledPack."""
+    def __init__(self, compiled: CompiledPack, raw: Any, intermediate: Any, unknown_items: Optional[List[Dict[str, int]]]=None):
+        self.compiled = compiled
+        """The CompiledPack the orders were evaluated against."""
+
+        self.unknown_items = unknown_items
+        """Items of each order that don't appear in the CompiledPack (see get_unknown_items). They have no column in the matrices, but they are raw materials all the same."""
+
+        self.raw = raw
+        """Matrix of how many of each raw material (item without a recipe) every order needs."""
+
+        self.intermediate = intermediate
+        """Matrix of how many of each craftable item has to be crafted as part of every order, not counting the items the order asked for directly. This matches App.evaluated_items."""
+
+    def __len__(self) -> int:
+        return self.raw.shape[0]
+
+    def get_raw_materials(self, order: int) -> Dict[str, int]:
+        """Returns a dictionary mapping the names of raw materials to amounts for an order, like App.calculate_costs."""
+        result = self._row_to_dict(self.raw[order])
+
+        if self.unknown_items is not None:
+            for name, amount in self.unknown_items[order].items():
+                if amount != 0:
+                    result[name] = result.get(name, 0) + amount
+
+        return result
+
+    def get_intermediate_items(self, order: int) -> Dict[str, int]:
+        """Returns a dictionary mapping the names of intermediate crafted items to amounts for an order."""
+        return self._row_to_dict(self.intermediate[order])
+
+    def _row_to_dict(self, row: Any) -> Dict[str, int]:
+        """Converts a row of one of the matrices to a dictionary, skipping items with an amount of 0."""
+        return {self.compiled.names[item_id]: int(row[item_id]) for item_id in np.flatnonzero(row)}
+
+
+def make_demand_matrix(compiled: CompiledPack, orders: List[Dict[str, int]]) -> Any:
+    """Creates a demand matrix from a list of orders (dictionaries mapping item names to amounts), with one row per order. Items that are not part of the pack have no column, so they have to be passed to evaluate_orders separately (see get_unknown_items and evaluate_order_list)."""
+    demand = np.zeros((len(orders), len(compiled.names)), dtype=object)
+
+    for row, order in enumerate(orders):
+        for name, amount in order.items():
+            item_id = compiled.get_id(name)
+
+            if item_id >= 0:
+                demand[row, item_id] += amount
+
+    return demand
+
+
+def get_unknown_items(compiled: CompiledPack, orders: List[Dict[str, int]]) -> List[Dict[str, int]]:
+    """Returns the items of each order that don't appear in the CompiledPack. The scalar engine treats them as raw materials, since they have no recipe."""
+    return [{name: amount for name, amount in order.items() if compiled.get_id(name) < 0} for order in orders]
+
+
+class _Level:
+    """_Level stores the edges leaving one depth level of the compiled pack, since those are processed together."""
+    def __init__(self, compiled: CompiledPack, start: int, end: int):
+        self.start = start
+        """First item id in the level."""
+
+        self.end = end
+        """Item id after the last item in the level."""
+
+        self.produces = np.asarray(compiled.produces[start:end], dtype=np.int64)
+        """How many items each craft produces for each item in the level."""
+
+        offsets = np.asarray(compiled.offsets[start:end + 1], dtype=np.int64)
+
+        self.sources = np.repeat(np.arange(end - start), np.diff(offsets))
+        """Index within the level of the item that each edge comes from."""
+
+        self.targets = np.asarray(compiled.input_ids[offsets[0]:offsets[-1]], dtype=np.int64)
+        """Item id of the input that each edge goes to."""
+
+        self.amounts = np.asarray(compiled.input_amounts[offsets[0]:offsets[-1]], dtype=np.int64)
+        """How many of the input each edge needs per craft."""
+
+        self.max_amount = int(self.amounts.max()) if len(self.amounts) > 0 else 0
+        """Largest per-craft amount in the level, used for overflow checks."""
+
+        self.max_fan_in = int(np.unique(self.targets, return_counts=True)[1].max()) if len(self.targets) > 0 else 0
+        """Largest number of edges in the level going to the same input, used for overflow checks."""
+
+
+def _get_levels(compiled: CompiledPack) -> List[_Level]:
+    """Splits the craftable items of a CompiledPack into depth levels, starting with the highest depth. Since craftable ids are sorted by depth, each level is a contiguous range of ids."""
+    levels: List[_Level] = []
+    start = 0
+
+    while start < compiled.craftable_count:
+        end = start
+
+        while end < compiled.craftable_count and compiled.depths[end] == compiled.depths[start]:
+            end += 1
+
+        levels.append(_Level(compiled, start, end))
+        start = end
+
+    return levels
+
+
+def _propagate(compiled: CompiledPack, levels: List[_Level], demand: Any, dtype: Any, unknown_items: Optional[List[Dict[str, int]]]) -> BatchResult:
+    """Propagates a demand matrix down through every level of the compiled pack. Raises an OverflowError if an int64 matrix would overflow."""
+    demand = demand.astype(dtype)
+    intermediate = np.zeros_like(demand)
+    check_overflow = dtype != object
+
+    for level in levels:
+        if len(level.targets) == 0:
+            continue
+
+        # Number of crafts for every item in the level: ceil(demand / amount produced)
+        crafts = -(-demand[:, level.start:level.end] // level.produces)
+
+        if check_overflow and crafts.size > 0 and int(crafts.max()) > INT64_MAX // max(level.max_amount, 1):
+            raise OverflowError("Demand is too large for an int64 matrix")
+
+        # ceil(demand / amount produced) * amount needed per craft, for every edge at once
+        needed = crafts[:, level.sources] * level.amounts
+
+        # Each input gets at most max_fan_in edges added to it, so make sure even the biggest of them all landing on the biggest demand still fits. Intermediate amounts are part of the demand, so they fit as well.
+        if check_overflow and needed.size > 0 and int(demand[:, level.targets].max()) + level.max_fan_in * int(needed.max()) > INT64_MAX:
+            raise OverflowError("Demand is too large for an int64 matrix")
+
+        np.add.at(demand, (slice(None), level.targets), needed)
+        np.add.at(intermediate, (slice(None), level.targets), needed)
+
+    # Crafted items are not raw materials, so clear them out of the raw matrix
+    demand[:, :compiled.craftable_count] = 0
+    intermediate[:, compiled.craftable_count:] = 0
+
+    return BatchResult(compiled, demand, intermediate, unknown_items)
+
+
+def evaluate_orders(compiled: CompiledPack, demand: Any, unknown_items: Optional[List[Dict[str, int]]]=None) -> BatchResult:
+    """Evaluates many orders at once. demand is a matrix with one row per order and one column per item id in the CompiledPack (see make_demand_matrix). unknown_items holds the items of each order that aren't in the CompiledPack (see get_unknown_items), which are added to the raw materials.
+
+    Demand is propagated level by level with vectorized ceil-division, using int64 matrices when the numbers fit and Python integers otherwise, so the results match the scalar get_cost path exactly."""
+    levels = _get_levels(compiled)
+    demand = np.asarray(demand)
+
+    try:
+        if demand.size == 0 or int(demand.max()) <= INT64_MAX:
+            return _propagate(compiled, levels, demand, np.int64, unknown_items)
+    except OverflowError:
+        pass
+
+    return _propagate(compiled, levels, demand, object, unknown_items)
+
+
+def evaluate_order_list(compiled: CompiledPack, orders: List[Dict[str, int]]) -> BatchResult:
+    """Evaluates a list of orders (dictionaries mapping item names to amounts) at once, the same as the scalar engine would one by one. Items that aren't part of the pack count as raw materials."""
+    return evaluate_orders(compiled, make_demand_matrix(compiled, orders), get_unknown_items(compiled, orders))
@@ -0,0 +1,191 @@
+import argparse
+import contextlib
+import io
+import json
+import platform
+import shutil
+import subprocess
+import tempfile
+import time
+import tracemalloc
+
+
+from synthetic_packs import *
+import calculator
+import pack_cache
+
+
+def time_call(function: Callable[[], Any], setup: Optional[Callable[[], Any]]=None, repeat: int=5) -> Dict[str, float]:
+    """Times a function, returning the minimum and mean in seconds. The setup function is run before every call and isn't included in the time."""
+    times: List[float] = []
+
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+
+    return {"min": min(times), "mean": sum(times) / len(times), "repeat": repeat}
+
+
+def measure_memory(function: Callable[[], Any], setup: Optional[Callable[[], Any]]=None) -> Dict[str, float]:
+    """Measures the memory used by a function with tracemalloc, returning the peak and the amount still held by the result in bytes."""
+    if setup is not None:
+        setup()
+
+    tracemalloc.start()
+
+    result = function()
+    retained, peak = tracemalloc.get_traced_memory()
+
+    tracemalloc.stop()
+
+    del result
+
+    return {"peak": peak, "retained": retained}
+
+
+def write_app_config(directory: str, pack_path: str, addon_paths: List[str]):
+    """Writes an app-config.yaml for the benchmark, with every output option turned on."""
+    with open(os.path.join(directory, "app-config.yaml"), "w+") as f:
+        f.write(f"current pack: {json.dumps(pack_path)}\n")
+        f.write(f"addons: {json.dumps(addon_paths)}\n")
+        f.write("print items without recipes: true\n")
+        f.write("display all raw materials: true\n")
+        f.write("html output: true\n")
+        f.write("show left over amount: true\n")
+        f.write("use alternate sorting depth method: false\n")
+        f.write("show crafting bytes: true\n")
+
+
+def benchmark_scenario(scenario: SyntheticPack, directory: str, repeat: int) -> Dict[str, Dict[str, float]]:
+    """Runs every benchmark against a generated pack, returning the timings for each entry point."""
+    pack_path, addon_paths = scenario.write(directory)
+    write_app_config(directory, pack_path, addon_paths)
+
+    os.chdir(directory)
+
+    results: Dict[str, Dict[str, float]] = {}
+
+    results["load_pack_config"] = time_call(lambda: load_pack_config(pack_path), repeat=repeat)
+    results["load_pack_config memory"] = measure_memory(lambda: load_pack_config(pack_path))
+
+    # Cold loads parse everything and write the cache, warm loads only read the cache back
+    clear_cache = lambda: shutil.rmtree(pack_cache.PACK_CACHE_DIRECTORY, ignore_errors=True)
+
+    results["load_cached_pack (cold)"] = time_call(lambda: pack_cache.load_cached_pack(pack_path, addon_paths), setup=clear_cache, repeat=repeat)
+    results["load_cached_pack (warm)"] = time_call(lambda: pack_cache.load_cached_pack(pack_path, addon_paths), repeat=repeat)
+
+    # Switching between addon sets: reloading everything for each set, against layering the addons over a pack that stays loaded
+    if len(addon_paths) > 0:
+        addon_sets = [addon_paths[:count] for count in range(len(addon_paths) + 1)]
+        layers = pack_cache.PackLayers(pack_path)
+        layers.get_layer(pack_path)
+
+        def swap_addons_reloading():
+            for addon_set in addon_sets:
+                pack_cache.load_merged_pack(pack_path, addon_set)
+
+        def swap_addons_layered():
+            for addon_set in addon_sets:
+                layers.resolve(addon_set)
+
+        results["addon swap (reload)"] = time_call(swap_addons_reloading, repeat=repeat)
+        results["addon swap (layered)"] = time_call(swap_addons_layered, setup=layers.resolved.clear, repeat=repeat)
+
+    # The App prints while it works, which shouldn't end up in the benchmark output
+    with contextlib.redirect_stdout(io.StringIO()):
+        results["App.__init__"] = time_call(lambda: calculator.App(clear_screen=False), repeat=repeat)
+
+        app = calculator.App(clear_screen=False)
+
+        results["App.load_recipes"] = time_call(app.load_recipes, setup=lambda: app.pack.depths.clear(), repeat=repeat)
+
+        results["App.calculate_costs"] = time_call(lambda: app.calculate_costs(scenario.order.copy()), setup=app.reset, repeat=repeat)
+        results["App.calculate_costs memory"] = measure_memory(lambda: app.calculate_costs(scenario.order.copy()), setup=app.reset)
+        results["App.calculate_costs_topological"] = time_call(lambda: app.calculate_costs_topological(scenario.order.copy()), setup=app.reset, repeat=repeat)
+
+        results["App.get_results"] = time_call(lambda: app.get_results(scenario.order.copy()), setup=app.reset, repeat=repeat)
+        results["App.get_results memory"] = measure_memory(lambda: app.get_results(scenario.order.copy()), setup=app.reset)
+
+        app.reset()
+        depth_results = app.get_results(scenario.order.copy())
+
+        results["App.print_results"] = time_call(lambda: app.print_results(depth_results), repeat=repeat)
+
+        results["App.write_html"] = time_call(lambda: app.write_html(scenario.order.copy()), setup=app.reset, repeat=repeat)
+
+    # The trie gets the same words as the calchelper GUI's autocomplete
+    words = [word for item, recipe in scenario.pack.get_recipes_iterable() for name in [item] + [stack.name for stack in recipe.inputs] for word in name.split(" ")]
+    prefixes = sorted(set([word[:2] for word in words if len(word) >= 2]))
+
+    trie = Trie()
+
+    def add_words():
+        for word in words:
+            trie.add_word(word)
+
+    def predict_words():
+        for prefix in prefixes:
+            trie.predict_word(prefix)
+
+    results["Trie.add_word"] = time_call(add_words, repeat=1)
+    results["Trie.predict_word"] = time_call(predict_words, repeat=repeat)
+
+    results["calchelper.save_data"] = time_call(lambda: calchelper.save_data(os.path.join(directory, "saved.yaml"), scenario.pack, force=True), repeat=repeat)
+
+    return results
+
+
+def get_git_commit() -> Optional[str]:
+    """Returns the current git commit, if the benchmarks are being run from a git repository."""
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks the cost calculator against synthetic packs.")
+    parser.add_argument("--size", type=int, default=500, help="Number of recipes to generate for each scenario (deep chains should stay below the recursion limit for the recursive engine).")
+    parser.add_argument("--repeat", type=int, default=5, help="How many times to run each benchmark.")
+    parser.add_argument("--scenario", action="append", choices=sorted(SCENARIOS.keys()), help="Only run the given scenario (can be used more than once).")
+    parser.add_argument("--output", default="benchmark-report.json", help="Path to write the JSON report to.")
+    args = parser.parse_args()
+
+    output_path = os.path.abspath(args.output)
+    starting_directory = os.getcwd()
+
+    report: Dict[str, Any] = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "git_commit": get_git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "size": args.size,
+        "scenarios": {}
+    }
+
+    for name in args.scenario or SCENARIOS.keys():
+        scenario = SCENARIOS[name](args.size)
+
+        with tempfile.TemporaryDirectory() as directory:
+            report["scenarios"][name] = benchmark_scenario(scenario, directory, args.repeat)
+
+        os.chdir(starting_directory)
+
+        for benchmark, timing in report["scenarios"][name].items():
+            if "peak" in timing:
+                print(f"{name:16} {benchmark:34} {timing['peak'] / 1024:10.1f} KiB peak {timing['retained'] / 1024:10.1f} KiB retained")
+            else:
+                print(f"{name:16} {benchmark:34} {timing['min'] * 1000:10.3f} ms")
+
+    with open(output_path, "w+") as f:
+        json.dump(report, f, indent=4)
+
+    print(f"\nWrote report to {output_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+import os
+import random
+import sys
+
+
+# The benchmarks live in their own directory, so the main modules have to be added to the path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+from typing import Callable, Dict, List, Tuple
+from utils import *
+import calchelper
+
+
+class SyntheticPack:
+    """SyntheticPack is a generated recipe pack used for benchmarking, along with any addons and the order to calculate."""
+    def __init__(self, name: str, pack: PackConfigFile, order: Dict[str, int], addons: List[PackConfigFile]=[]):
+        self.name = name
+        """Name of the scenario the pack was generated for."""
+
+        self.pack = pack
+        """The main pack."""
+
+        self.order = order
+        """Items to calculate the costs of, mapping item names to amounts."""
+
+        self.addons = addons
+        """Addon packs that are loaded on top of the main pack."""
+
+    def write(self, directory: str) -> Tuple[str, List[str]]:
+        """Writes the pack and its addons to a directory in the same format as packs/example.yaml, returning the path to the pack and the paths to the addons."""
+        os.makedirs(directory, exist_ok=True)
+
+        pack_path = os.path.join(directory, f"{self.name}.yaml")
+        calchelper.save_data(pack_path, self.pack)
+
+        addon_paths: List[str] = []
+
+        for index, addon in enumerate(self.addons):
+            addon_path = os.path.join(directory, f"{self.name}-addon-{index}.yaml")
+            calchelper.save_data(addon_path, addon)
+            addon_paths.append(addon_path)
+
+        return pack_path, addon_paths
+
+
+def add_recipe(pack: PackConfigFile, output: str, inputs: List[Tuple[int, str]], produces: int=1):
+    """Adds a recipe to a pack from a list of (amount, name) inputs."""
+    pack.set_recipe(output, CraftingRecipe(output, [ItemStack(name, amount) for amount, name in inputs], produces))
+
+
+def deep_chain(size: int) -> SyntheticPack:
+    """A single chain of recipes where each item is crafted from the one before it, so the depth is equal to the size."""
+    pack = PackConfigFile(None)
+
+    add_recipe(pack, "chain 0", [(1, "stone")])
+
+    for index in range(1, size):
+        add_recipe(pack, f"chain {index}", [(1, f"chain {index - 1}"), (1, "stone")])
+
+    return SyntheticPack("deep-chain", pack, {f"chain {size - 1}": 1})
+
+
+def wide_fan_out(size: int) -> SyntheticPack:
+    """A shallow pack where a few top level items each use a large number of different inputs."""
+    pack = PackConfigFile(None)
+    width = max(1, int(size ** 0.5))
+
+    for index in range(size):
+        add_recipe(pack, f"part {index}", [(2, f"ore {index % 97}"), (1, f"dust {index % 89}")])
+
+    for top in range(width):
+        add_recipe(pack, f"machine {top}", [(1 + index % 4, f"part {index}") for index in range(top, size, width)])
+
+    return SyntheticPack("wide-fan-out", pack, {f"machine {top}": 1 + top % 3 for top in range(width)})
+
+
+def diamonds(size: int, width: int=8) -> SyntheticPack:
+    """Layers of items where every item uses several items from the layer below it, so sub-crafts are shared by many paths through the tree."""
+    pack = PackConfigFile(None)
+    generator = random.Random(size)
+    layers = max(2, size // width)
+
+    for index in range(width):
+        add_recipe(pack, f"layer 0 item {index}", [(1, f"raw {index}")])
+
+    for layer in range(1, layers):
+        for index in range(width):
+            inputs = generator.sample(range(width), 3)
+            add_recipe(pack, f"layer {layer} item {index}", [(1 + choice % 2, f"layer {layer - 1} item {choice}") for choice in inputs])
+
+    return SyntheticPack("diamonds", pack, {f"layer {layers - 1} item {index}": 1 for index in range(width)})
+
+
+def large_produces(size: int, layers: int=6) -> SyntheticPack:
+    """A layered pack where recipes produce large stacks of items, which exercises the ceil-per-craft rounding and leftovers."""
+    pack = PackConfigFile(None)
+    generator = random.Random(size)
+    width = max(2, size // layers)
+
+    for layer in range(layers):
+        for index in range(width):
+            inputs = [(generator.randint(1, 64), f"bulk {layer - 1} {choice}") for choice in generator.sample(range(width), 2)] if layer > 0 else []
+            add_recipe(pack, f"bulk {layer} {index}", inputs + [(generator.randint(1, 1000), "fluid")], generator.choice([1, 4, 16, 64, 1000]))
+
+    return SyntheticPack("large-produces", pack, {f"bulk {layers - 1} {index}": 12345 for index in range(min(width, 10))})
+
+
+def addon_overlay(size: int, addon_count: int=5) -> SyntheticPack:
+    """A base pack with several addons that each replace a large share of its recipes."""
+    base = diamonds(size)
+    generator = random.Random(size)
+    addons: List[PackConfigFile] = []
+
+    for _ in range(addon_count):
+        addon = PackConfigFile(None)
+
+        for item, recipe in base.pack.get_recipes_iterable():
+            if generator.random() < 0.3:
+                add_recipe(addon, item, [(stack.amount + 1, stack.name) for stack in recipe.inputs], recipe.amount_produced)
+
+        addons.append(addon)
+
+    return SyntheticPack("addon-overlay", base.pack, base.order, addons)
+
+
+SCENARIOS: Dict[str, Callable[[int], SyntheticPack]] = {
+    "deep-chain": deep_chain,
+    "wide-fan-out": wide_fan_out,
+    "diamonds": diamonds,
+    "large-produces": large_produces,
+    "addon-overlay": addon_overlay,
+}
+"""Maps scenario names to the functions that generate them from a size."""
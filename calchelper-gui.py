@@ -3,9 +3,21 @@ from typing import Callable
 import flet as ft # type: ignore
 import calchelper as ch
 import re
+import threading
+import time
+import traceback
 
 
 from utils import *
+from pack_cache import FileVersion, get_file_version, get_pack_stamps, read_pack_trie, write_pack_trie
+from profiling import LatencyHistogram
+
+
+PREDICTION_DEBOUNCE_SECONDS = 0.005
+"""How long the prediction worker waits for more keystrokes before predicting. This is kept well under a frame, so suggestions still show up right away."""
+
+prediction_latencies = LatencyHistogram()
+"""Time from a keystroke to its autocomplete suggestion being shown, which is printed when the GUI is closed."""
 
 
 def wrap_expand(obj: Optional[ft.Control], exp: int) -> ft.Control:
@@ -22,42 +34,10 @@ def center_object(obj: ft.Control):
     ], expand=True, alignment=ft.MainAxisAlignment.CENTER)
     
     
-class RecipeLoopError(Exception):
-    """RecipeLoopError is raised when a recipe loop is detected when working with get_all_raw_materials."""
-    def __init__(self, name: str):
-        self.name = name
-        """Name of the item which caused the error."""
-        
-        super().__init__(f"RecipeLoopError with item {name}")
-
-
 def get_all_raw_materials(_item: str, pack: PackConfigFile) -> Set[str]:
     """Modified version of get_all_raw_materials for this program, works similarly to the version in calchelper.py. Raises a RecipeLoopError if a recipe loop is detected."""
-    cache: Dict[str, Set[str]] = {}
-
-    # Recursive helper function which is memoized
-    def get_all_raw_materials2(item: str) -> Set[str]:
-        try:
-            if item in cache:
-                return cache[item]
-            else:
-                result: Set[str] = set()
-                
-                recipe = pack.get_recipe(item)
-                
-                if recipe is None:
-                    result.add(item)
-                else:
-                    for item2 in recipe.get_item_types():
-                        result.update(get_all_raw_materials2(item2))
-
-                cache[item] = result
-                return result
-        except:
-            print(f"RecipeLoopError with item {item}")
-            raise RecipeLoopError(item)
-
-    return get_all_raw_materials2(_item)
+    # The pack keeps a closure index, so only recipes that changed since the last call are walked again. It raises a RecipeLoopError from the depth cache for items affected by a recipe loop.
+    return pack.get_all_raw_materials(_item)
 
 
 class GlobalState:
@@ -250,24 +230,130 @@ class RecipeInputTextField(ft.TextField):
         self.pack = self.parent.pack
         """PackConfigFile to use."""
 
-        self.trie = Trie()
-        """The Trie is used for the auto-complete feature based on the recipes in the pack."""
+        self.trie: Optional[Trie] = None
+        """The Trie is used for the auto-complete feature based on the recipes in the pack. It is None until the worker thread has finished loading it, and auto-complete is turned off until then."""
 
-        for item, recipe in self.pack.get_recipes_iterable():
-            # Start with the words from the output item
-            for word in item.split(" "):
-                self.trie.add_word(word)
+        self.trie_lock = threading.Lock()
+        """Lock protecting trie and pending_words, since the Trie is handed over from the worker thread."""
 
-            # Now get the words from the input items
-            for item in recipe.inputs:
-                for word in item.name.split(" "):
-                    self.trie.add_word(word)
+        self.pending_words: List[Tuple[str, int]] = []
+        """Words (and multipliers) added while the Trie was still loading, which are added once it is ready."""
+
+        # Snapshot the words on this thread, so editing the pack can't change them while the worker reads them
+        names = [name for item, recipe in self.pack.get_recipes_iterable() for name in [item] + [stack.name for stack in recipe.inputs]]
+        names.extend([item for _, items in self.pack.get_special_item_lists_iterable() for item in items])
+
+        # Only the size and modification times are checked here, hashing the pack is left to the worker
+        version = get_file_version(self.parent.file_name) if os.path.exists(self.parent.file_name) else None
+
+        # Building the Trie for a big pack takes a while, so it is done while the UI comes up
+        threading.Thread(target=self.load_trie, args=(names, version), daemon=True).start()
+
+        self.prediction_condition = threading.Condition()
+        """Condition used to hand prediction requests to the prediction worker. It also protects prediction_request and prediction_generation."""
+
+        self.prediction_request: Optional[Tuple[int, str, float]] = None
+        """Newest prediction request that hasn't been handled yet, as (generation, word, time of the keystroke)."""
+
+        self.prediction_generation = 0
+        """Goes up on every keystroke, so the worker can tell if a prediction is stale by the time it finishes."""
+
+        # Predictions are made on a worker thread, so typing never waits on the Trie
+        threading.Thread(target=self.prediction_worker, daemon=True).start()
+
+    def load_trie(self, names: List[str], version: Optional[FileVersion]):
+        """Loads the Trie on a worker thread. The Trie saved next to the pack is used if the pack and its journal haven't changed, otherwise it is built from the names and saved for next time. version is the version of the pack files when the names were taken."""
+        stamps = None if version is None else get_pack_stamps(self.parent.file_name)
+
+        # If the pack was edited after the names were taken, the stamps don't describe the names any more, so the saved Trie can't be used or replaced
+        if stamps is not None and get_file_version(self.parent.file_name) != version:
+            stamps = None
+
+        trie = None if stamps is None else read_pack_trie(self.parent.file_name, stamps)
+
+        if trie is None:
+            trie = Trie()
+
+            for name in names:
+                for word in name.split(" "):
+                    trie.add_word(word)
+
+            # Set up autocomplete for ae2_fluid, raw_material, check, and delete to prioritize them
+            trie.add_word("ae2_fluid", 1000)
+            trie.add_word("raw_material", 1000)
+            trie.add_word("check", 1000)
+            trie.add_word("delete", 1000)
+
+            if stamps is not None:
+                write_pack_trie(self.parent.file_name, stamps, trie)
+
+        with self.trie_lock:
+            for word, multiplier in self.pending_words:
+                trie.add_word(word, multiplier)
+
+            self.pending_words = []
+            self.trie = trie
 
-        # Set up autocomplete for ae2_fluid, raw_material, check, and delete to prioritize them
-        self.trie.add_word("ae2_fluid", 1000)
-        self.trie.add_word("raw_material", 1000)
-        self.trie.add_word("check", 1000)
-        self.trie.add_word("delete", 1000)
+    def request_prediction(self, word: str):
+        """Asks the prediction worker to predict a word, replacing any request it hasn't handled yet. An empty word clears the suggestion right away instead."""
+        with self.prediction_condition:
+            self.prediction_generation += 1
+
+            if word == "":
+                self.prediction_request = None
+                self.suffix_text = ""
+            else:
+                self.prediction_request = (self.prediction_generation, word, time.perf_counter())
+                self.prediction_condition.notify()
+
+    def prediction_worker(self):
+        """Runs on a worker thread, predicting words for the newest request and showing the suggestion if no newer keystroke came in while predicting."""
+        while True:
+            # A failed prediction only loses that one suggestion, the worker keeps going so auto-complete doesn't stop for good
+            try:
+                self.handle_prediction_request()
+            except Exception:
+                traceback.print_exc()
+
+    def handle_prediction_request(self):
+        """Waits for the next prediction request and handles it. Called over and over by prediction_worker."""
+        with self.prediction_condition:
+            while self.prediction_request is None:
+                self.prediction_condition.wait()
+
+        # Gives fast typing a moment to replace the request, so only the newest word gets predicted
+        time.sleep(PREDICTION_DEBOUNCE_SECONDS)
+
+        with self.prediction_condition:
+            request = self.prediction_request
+            self.prediction_request = None
+
+        if request is None:
+            return
+
+        generation, word, start = request
+
+        # add_word changes the Trie from the UI thread, so it is only read under the lock (auto-complete is off until the Trie has loaded)
+        with self.trie_lock:
+            suggestion = "" if self.trie is None else self.trie.predict_word(word)
+
+        with self.prediction_condition:
+            if generation != self.prediction_generation:
+                return
+
+            self.suffix_text = suggestion
+
+        self.update()
+
+        prediction_latencies.record(time.perf_counter() - start)
+
+    def add_word(self, word: str, multiplier: int=1):
+        """Adds a word to the Trie, or saves it for later if the Trie is still loading."""
+        with self.trie_lock:
+            if self.trie is None:
+                self.pending_words.append((word, multiplier))
+            else:
+                self.trie.add_word(word, multiplier)
 
     def auto_complete_index(self, value: str) -> int:
         """Finds the correct index to use for auto-complete."""
@@ -290,7 +376,7 @@ class RecipeInputTextField(ft.TextField):
             return
 
         if len(value) == 0:
-            self.suffix_text = ""
+            self.request_prediction("")
         else:
             # Get the index to split at
             index = self.auto_complete_index(value)
@@ -298,11 +384,11 @@ class RecipeInputTextField(ft.TextField):
             # Find everything after the splitting index
             tmp_word = value[index:].strip()
 
-            if tmp_word == "": # Empty word, no need for prediction
-                self.suffix_text = ""
-            else:
-                # Attempt to make a prediction
-                self.suffix_text = self.trie.predict_word(tmp_word)
+            # An empty word clears the suggestion, anything else is predicted by the worker, which updates the component itself
+            self.request_prediction(tmp_word)
+
+            if tmp_word != "":
+                return
                 
         # Update the component
         self.update()
@@ -369,16 +455,16 @@ class RecipeInputTextField(ft.TextField):
             self.create_recipe(self.output_item, inputs)
 
             for word in self.output_item.name.split(" "):
-                self.trie.add_word(word)
+                self.add_word(word)
 
             for item in inputs:
                 for word in item.name.split(" "):
                     if len(word) > 0:
-                        self.trie.add_word(word)
+                        self.add_word(word)
 
         # Reset the textbox values after submitting
         self.value = ""
-        self.suffix_text = "" # type: ignore
+        self.request_prediction("")
         self.focus()
 
         self.update()
@@ -386,7 +472,7 @@ class RecipeInputTextField(ft.TextField):
     def add_words_from_item(self, longer_word: str):
         """Updates the internal Trie with the words from a longer word split by spaces."""
         for word in longer_word.split(" "):
-            self.trie.add_word(word)
+            self.add_word(word)
 
         self.update()
 
@@ -478,7 +564,7 @@ class RecipeOutputItem(ft.Container):
                     # Remove items already included in the recipe
                     raw_materials = [mat for mat in get_all_raw_materials(item_name, pack).difference(unique_items) if (not mat in materials) and mat != item_name]
                 except RecipeLoopError as error:
-                    self.content.controls.append(ft.Row([ft.Text(f"Recipe loop found with item {error.name}!", size=16, color=ft.colors.BLACK, expand=True)]))
+                    self.content.controls.append(ft.Row([ft.Text(f"Recipe loop found with item {error.name}! (loop: {', '.join(error.items)})", size=16, color=ft.colors.BLACK, expand=True)]))
 
             # Now display the missing items
             if len(missing_items) > 0 or len(raw_materials) > 0:
@@ -758,11 +844,15 @@ class FluidMaterialsModifier(ft.Container):
 
     def add_material(self, material: str):
         """Adds a material to the list of materials."""
+        journal: ch.PackJournal = self.parent.parent.journal
+
         if self.state == FluidMaterialsState.MATERIALS:
             if material not in self.pack.get_raw_materials():
                 self.pack.add_raw_material(material)
+                journal.add_raw_material(material)
         elif material not in self.pack.get_ae2_fluids():
             self.pack.add_ae2_fluid(material)
+            journal.add_ae2_fluid(material)
             
         # Add to the RecipeOutput with the given material
         self.parent.parent.recipe_adder.recipe_output.display_text(f"Added new {self.get_text_modifier()} {material}")
@@ -785,17 +875,15 @@ class FluidMaterialsModifier(ft.Container):
         if name == "":
             return
 
+        journal: ch.PackJournal = self.parent.parent.journal
+
         if self.state == FluidMaterialsState.MATERIALS:
             if name in self.pack.get_raw_materials():
-                mats = self.pack.get_recipe("materials")
-
-                if mats is not None:
-                    mats.inputs = [item for item in mats.inputs if item.name != name]
+                self.pack.remove_raw_material(name)
+                journal.remove_raw_material(name)
         elif name in self.pack.get_ae2_fluids():
-            mats = self.pack.get_recipe("ae2_fluids")
-
-            if mats is not None:
-                mats.inputs = [item for item in mats.inputs if item.name != name]
+            self.pack.remove_ae2_fluid(name)
+            journal.remove_ae2_fluid(name)
             
         # Add to the RecipeOutput with the given material
         self.parent.parent.recipe_adder.recipe_output.display_text(f"Removed {self.get_text_modifier()} {value}")
@@ -884,7 +972,10 @@ class Calchelper(ft.UserControl):
         """Configs used by the app."""
 
         self.pack = load_pack_config(self.file_name)
-        """Pack file used by calchelper."""
+        """Pack file used by calchelper. Edits that weren't saved last time are replayed from the journal."""
+
+        self.journal = ch.PackJournal(self.file_name)
+        """Journal that every edit is written to, so edits aren't lost before the pack is saved."""
 
     def build(self) -> ft.Container: # type: ignore
         self.recipe_adder = RecipeAdder(4, self, self.app_config)
@@ -954,18 +1045,26 @@ class Calchelper(ft.UserControl):
 
         if self.pack.has_recipe(item_name):
             self.pack.delete_recipe(item_name)
+            self.journal.delete_recipe(item_name)
 
     def create_recipe(self, output: ItemStack, inputs: List[ItemStack]):
         """Creates a recipe using the output and input ItemStacks."""
         # Sets the recipe for the pack
-        self.pack.set_recipe(output.name, CraftingRecipe.create_with_itemstack(output, inputs))
+        recipe = CraftingRecipe.create_with_itemstack(output, inputs)
+
+        self.pack.set_recipe(output.name, recipe)
+        self.journal.set_recipe(recipe)
+
+        # The pack file is only rewritten once the journal gets big
+        if self.journal.should_compact():
+            self.journal.compact(self.pack)
 
         # Now display the recipe
         self.display_recipe(output.name, self.pack)
 
     def save_clicked(self, _: Any):
         """Function that runs when the save button is clicked."""
-        ch.save_data(self.file_name, self.pack)
+        self.journal.compact(self.pack)
         print(f"Saved to {self.file_name}")
 
     def on_tab_press(self):
@@ -1007,4 +1106,10 @@ def recipe_screen(page: ft.Page):
 ft.app(target=launch_screen) # type: ignore
 
 
-ft.app(target=recipe_screen) # type: ignore
\ No newline at end of file
+ft.app(target=recipe_screen) # type: ignore
+
+
+# Shows how quickly autocomplete suggestions appeared, to check they stay within a frame
+if prediction_latencies.get_total() > 0:
+    print("Autocomplete latency:")
+    print(prediction_latencies.format())
@@ -1,4 +1,8 @@
+import json
 import re
+import shutil
+import tempfile
+from typing import Iterable, TextIO
 
 
 from utils import *
@@ -18,35 +22,12 @@ def parse_text(text: str) -> Tuple[int, str]:
 
 def get_all_raw_materials(_item: str) -> Set[str]:
     """Gets the list of all the raw materials used to craft an item."""
-    cache: Dict[str, Set[str]] = {}
-
-    # Helper function that works with the cache recursively
-    def get_all_raw_materials2(item: str) -> Set[str]:
-        try:
-            # The function is memoized
-            if item in cache:
-                return cache[item]
-            else:
-                result: Set[str] = set()
-                
-                recipe = pack.get_recipe(item)
-
-                if recipe is None:
-                    result.add(item)
-                else:
-                    # Iterate over all item types in the given recipe and add their raw materials
-                    for item2 in recipe.get_item_types():
-                        result.update(get_all_raw_materials2(item2))
-
-                # Update cache
-                cache[item] = result
-                return result
-        except:
-            # If there is an exception, it most likely is because of a recipe loop
-            print(f"RecursionError with item {item}")
-            return set()
-
-    return get_all_raw_materials2(_item)
+    # The pack keeps a closure index, so only recipes that changed since the last call are walked again. Items affected by a recipe loop are flagged by the depth cache without recursing into them.
+    try:
+        return pack.get_all_raw_materials(_item)
+    except RecipeLoopError as e:
+        print(f"Recipe loop found with items {e.items}")
+        return set()
 
 
 def print_without_recipes(item: str):
@@ -75,25 +56,163 @@ def print_without_recipes(item: str):
                     print(f"\nRaw Materials: {[i for i in sorted(raw_materials)]}")
                     
 
-def save_data(path: str, _pack: Optional[PackConfigFile]=None):
-    """Saves the pack data to the file."""
+SAVE_CHUNK_SIZE = 256 * 1024
+"""Roughly how many characters save_data collects before writing them to the file."""
+
+
+def format_recipe(item: str, recipe: CraftingRecipe) -> str:
+    """Formats a recipe the way it is stored in pack files."""
+    produces = f"    produces: {recipe.amount_produced}\n\n" if recipe.amount_produced > 1 else ""
+    inputs = "".join([f"        - {item2}\n" for item2 in recipe.inputs])
+
+    return f"{item}:\n{produces}    items:\n{inputs}\n"
+
+
+def format_item_list(key: str, items: Iterable[str]) -> str:
+    """Formats a list of raw materials or fluids the way it is stored in pack files, which is the same shape as a recipe."""
+    inputs = "".join([f"        - {ItemStack(item2)}\n" for item2 in items])
+
+    return f"{key}:\n    items:\n{inputs}\n"
+
+
+def format_pack_entries(_pack: PackConfigFile) -> Iterator[str]:
+    """Yields every entry of the pack file in order, formatted the way it is stored. Raw materials and fluids go back where they were in the file the pack was loaded from, or after the recipes if they weren't in it."""
+    keys = list(_pack.special_list_positions) + [key for key in SPECIAL_ITEM_LISTS if key not in _pack.special_list_positions]
+    lists = [(key, _pack.get_special_item_list(key)) for key in keys if len(_pack.get_special_item_list(key)) > 0]
+    next_list = 0
+
+    for position, (item, recipe) in enumerate(_pack.get_recipes_iterable()):
+        # Positions only go up in file order, so the lists can be written as the recipes reach them
+        while next_list < len(lists) and _pack.special_list_positions.get(lists[next_list][0], len(_pack.recipes)) <= position:
+            yield format_item_list(*lists[next_list])
+            next_list += 1
+
+        yield format_recipe(item, recipe)
+
+    for key, items in lists[next_list:]:
+        yield format_item_list(key, items)
+
+
+def save_data(path: str, _pack: Optional[PackConfigFile]=None, force: bool=False) -> bool:
+    """Saves the pack data to the file, returning if the file was written. Nothing is written if the pack hasn't changed since it was loaded from or saved to the file, unless force is True.
+
+    The pack is written to a temporary file in large chunks, which then replaces the pack file, so a crash while saving can never leave a half written pack behind."""
     _pack = pack if _pack is None else _pack
 
-    # Start by opening the file
-    with open(path, "w+") as f:
-        for item, recipe in _pack.get_recipes_iterable():
-            f.write(f"{item}:\n")
+    if not force and not _pack.is_dirty(path):
+        return False
+
+    directory = os.path.dirname(os.path.abspath(path))
+    handle, temp_path = tempfile.mkstemp(dir=directory, prefix=".", suffix=".tmp")
+
+    try:
+        with os.fdopen(handle, "w") as f:
+            chunk: List[str] = []
+            chunk_size = 0
+
+            for entry in format_pack_entries(_pack):
+                chunk.append(entry)
+                chunk_size += len(entry)
+
+                if chunk_size >= SAVE_CHUNK_SIZE:
+                    f.write("".join(chunk))
+                    chunk = []
+                    chunk_size = 0
+
+            f.write("".join(chunk))
+
+            f.flush()
+            os.fsync(f.fileno())
+
+        # mkstemp only gives the owner access, so keep the permissions the pack file already had (or the ones a new file would get)
+        if os.path.exists(path):
+            shutil.copymode(path, temp_path)
+        else:
+            umask = os.umask(0)
+            os.umask(umask)
+            os.chmod(temp_path, 0o666 & ~umask)
+
+        os.replace(temp_path, path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+
+    _pack.mark_saved(path)
 
-            if recipe.amount_produced > 1:
-                f.write(f"    produces: {recipe.amount_produced}\n\n")
+    return True
 
-            f.write("    items:\n")
 
-            # this should work
-            for item2 in recipe.inputs:
-                f.write(f"        - {item2}\n")
+JOURNAL_COMPACT_BYTES = 1024 * 1024
+"""Once a pack's journal gets bigger than this (in bytes), it is compacted back into the pack file."""
 
-            f.write("\n")
+
+class PackJournal:
+    """PackJournal is an append-only log of the edits made to a pack, so each edit only has to write one line instead of the whole pack. Every entry is flushed to disk before returning, and load_pack_config replays the journal, so no edits are lost if the program stops before saving.
+
+    Compacting writes the pack file with save_data and clears the journal."""
+    def __init__(self, path: str, compact_bytes: int=JOURNAL_COMPACT_BYTES):
+        self.path = path
+        """Path of the pack file."""
+
+        self.journal_path = get_journal_path(path)
+        """Path of the journal file."""
+
+        self.compact_bytes = compact_bytes
+        """Size (in bytes) at which should_compact starts returning True."""
+
+        self.file: Optional[TextIO] = None
+        """The journal file, which is opened when the first edit is recorded."""
+
+    def record(self, entry: YAML_Data):
+        """Appends an entry to the journal and makes sure it is on disk."""
+        if self.file is None:
+            # A broken entry at the end would swallow the first new one, so it is cut off first
+            repair_journal(self.journal_path)
+
+            self.file = open(self.journal_path, "a", encoding="utf-8")
+
+        self.file.write(json.dumps(entry) + "\n")
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def set_recipe(self, recipe: CraftingRecipe):
+        """Records that a recipe was added or replaced."""
+        self.record({"op": "set", "item": recipe.output, "produces": recipe.amount_produced, "items": [str(stack) for stack in recipe.inputs]})
+
+    def delete_recipe(self, item: str):
+        """Records that a recipe was deleted."""
+        self.record({"op": "delete", "item": item})
+
+    def add_raw_material(self, material: str):
+        """Records that a raw material was added."""
+        self.record({"op": "add_material", "item": material})
+
+    def remove_raw_material(self, material: str):
+        """Records that a raw material was removed."""
+        self.record({"op": "remove_material", "item": material})
+
+    def add_ae2_fluid(self, fluid: str):
+        """Records that an AE2 fluid was added."""
+        self.record({"op": "add_fluid", "item": fluid})
+
+    def remove_ae2_fluid(self, fluid: str):
+        """Records that an AE2 fluid was removed."""
+        self.record({"op": "remove_fluid", "item": fluid})
+
+    def should_compact(self) -> bool:
+        """Returns if the journal has grown big enough that it should be compacted."""
+        return self.file is not None and self.file.tell() > self.compact_bytes
+
+    def compact(self, _pack: PackConfigFile):
+        """Saves the pack to the pack file and clears the journal. If the program stops in between, replaying the journal on top of the saved pack gives the same pack, so nothing is lost."""
+        save_data(self.path, _pack)
+
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+        if os.path.exists(self.journal_path):
+            os.remove(self.journal_path)
 
 
 def edit_configs_with_pack_name(name: str):
@@ -132,9 +251,14 @@ if __name__ == "__main__":
 
     print("")
 
-    # Loads the yaml file for the pack
+    # Loads the yaml file for the pack (along with any edits that weren't saved last time)
     pack = load_pack_config(file_name)
 
+    # Edits are written to the journal as they are made, and the pack file is only rewritten when saving
+    journal = PackJournal(file_name)
+
+    print_recipe_loops(pack)
+
     while True:
         # Gets the item to be produced
         output = input("output: ").strip()
@@ -144,9 +268,10 @@ if __name__ == "__main__":
 
         # Breaks the loop if needed
         if output == "-r":
+            journal.compact(pack)
             break
         elif output == "-s": # Saves data
-            save_data(file_name)
+            journal.compact(pack)
             print("Saved data!\n")
             continue
         elif command == "delete":
@@ -155,6 +280,7 @@ if __name__ == "__main__":
 
             if pack.has_recipe(item):
                 pack.delete_recipe(item)
+                journal.delete_recipe(item)
 
                 print(f"Entry {item} deleted!\n")
             else:
@@ -176,12 +302,27 @@ if __name__ == "__main__":
             else:
                 print(f"Entry {item} not found!\n")
 
+            continue
+        elif command == "used_by":
+            # Checks which recipes use an item
+            item = get_remaining_words(output)
+
+            used_by = pack.get_used_by(item)
+
+            if len(used_by) > 0:
+                print("Used by:", sorted(used_by))
+                print("Used by (including indirectly):", sorted(pack.get_all_used_by(item)))
+            else:
+                print(f"No recipes use {item}!")
+
+            print("")
             continue
         elif command == "raw_material":
             # Gets the material
             material = get_remaining_words(output)
 
             pack.add_raw_material(material)
+            journal.add_raw_material(material)
 
             print("")
             continue
@@ -197,6 +338,7 @@ if __name__ == "__main__":
             material = get_remaining_words(output)
 
             pack.add_ae2_fluid(material)
+            journal.add_ae2_fluid(material)
 
             print("")
             continue
@@ -221,7 +363,10 @@ if __name__ == "__main__":
         item_name = output.name
 
         # Sets the recipe for the pack
-        pack.set_recipe(item_name, CraftingRecipe.create_with_itemstack(output, parsed_inputs))
+        recipe = CraftingRecipe.create_with_itemstack(output, parsed_inputs)
+
+        pack.set_recipe(item_name, recipe)
+        journal.set_recipe(recipe)
 
         # Prints the items that don't have recipes
         print_without_recipes(item_name)
@@ -229,5 +374,7 @@ if __name__ == "__main__":
         # The empty line is part of the formatting
         print("")
 
-        save_data(file_name)
+        # The pack file is only rewritten once the journal gets big
+        if journal.should_compact():
+            journal.compact(pack)
         
\ No newline at end of file
@@ -1,11 +1,19 @@
+from concurrent.futures import ProcessPoolExecutor
 from io import TextIOWrapper
-import math
+import contextlib
+import heapq
+import io
+import json
 import sys
+import tempfile
 
 
-from collections import defaultdict
-from typing import Dict, List, Tuple, TypeVar
+from collections import defaultdict, deque
+from typing import Any, Deque, Dict, List, Tuple, TypeVar
 from utils import *
+from compiled_pack import CompiledPack, compile_pack, open_compiled_pack, write_compiled_pack
+from pack_cache import PackLayers, load_cached_pack, load_merged_pack
+from profiling import EngineCounters, PhaseProfiler, parse_profile_args
 
 
 T = TypeVar("T")
@@ -44,83 +52,88 @@ def convert_to_stack_list(dict: Dict[str, int]) -> List[ItemStack]:
     return [ItemStack(item_name, amount) for item_name, amount in dict.items()]
 
 
-master_depth_dictionary: Dict[str, int] = {}
-"""The master depth dictionary is used to help memoize the calculation of how deep in the recipe an item is."""
+def get_cost(target_items: int, required_per_craft: int, amount_produced: int) -> int:
+    """Gets how many of a specific item is needed for a craft. Pass in the target amount of items you need to craft, the amount of the given item required per craft, and the amount of the target item the craft produces each time."""
+    num_crafts = ceil_divide(target_items, amount_produced)
+    return num_crafts * required_per_craft
 
 
-def get_depth(pack: PackConfigFile, recipe: CraftingRecipe) -> int:
-    """Recursively calculates the depth of a given recipe in the pack. Memoizes the results as needed using the master_depth_dictionary."""
-    if recipe.output in master_depth_dictionary:
-        return master_depth_dictionary[recipe.output]
-    
-    # Store the item name here, which may get re-defined in the try statement
-    item_name = ""
+def add_item_to_counter(counter: Dict[str, int], line: str):
+    """Adds the item in a line of input (such as "8 cobblestone") to a counter of items. Blank lines are skipped."""
+    if line == "":
+        return
 
-    try:
-        # The maximum depth will automatically be the final depth
-        current_max_depth = 0
+    item_stack = make_item_stack(line)
 
-        for item in recipe.inputs:
-            depth = 1
+    counter[item_stack.name] += item_stack.amount
 
-            item_name = item.name
-            
-            item_recipe = pack.get_recipe(item_name)
 
-            if item_recipe is not None:
-                # The depth goes up for each layer
-                depth += get_depth(pack, item_recipe)
+BatchOrder = Tuple[Tuple[str, ...], Dict[str, int]]
+"""An order in batch mode: the addons to use for it, and a dictionary mapping item names to amounts."""
 
-            # Updates the current maximum if needed
-            current_max_depth = max(current_max_depth, depth)
 
-        master_depth_dictionary[recipe.output] = current_max_depth
+def parse_orders_file(path: str, addons: List[str]=[]) -> List[BatchOrder]:
+    """Reads a file of orders for batch mode. Each order is written the same way as items are entered into the calculator, with the stop command -r ending each order (the last -r is optional).
 
-        # We also need to update the recipe's depth
-        recipe.depth = current_max_depth
-        return current_max_depth
-    except:
-        print(f"Error with item {item_name}")
-        return 0
+    A line starting with -a switches the addons used for the orders after it, as a comma separated list of paths (-a on its own turns every addon off). Until then the given addons are used."""
+    orders: List[BatchOrder] = []
+    items_counter: defaultdict[str, int] = defaultdict(int)
+    current_addons = tuple(addons)
 
+    with open(path, "r") as f:
+        for line in f:
+            current_input = sanitize_input_string(line)
 
-def get_cost(target_items: int, required_per_craft: int, amount_produced: int) -> int:
-    """Gets how many of a specific item is needed for a craft. Pass in the target amount of items you need to craft, the amount of the given item required per craft, and the amount of the target item the craft produces each time."""
-    num_crafts = math.ceil(target_items / amount_produced) 
-    return num_crafts * required_per_craft
+            if current_input == "-r":
+                orders.append((current_addons, delete_zero_values(dict(items_counter))))
+                items_counter = defaultdict(int)
+            elif first_word(current_input) == "-a":
+                # Addon paths are case sensitive, so they are taken from the line as it was written
+                current_addons = tuple([addon.strip() for addon in line.strip()[2:].split(",") if addon.strip() != ""])
+            else:
+                add_item_to_counter(items_counter, current_input)
 
+    # The last order doesn't need a stop command
+    if len(items_counter) > 0:
+        orders.append((current_addons, delete_zero_values(dict(items_counter))))
 
-DepthDictionary = Dict[int, List[ItemStack]]
-"""DepthDictionaries map integer depths to a list of ItemStacks. They are used for calculating costs."""
+    return orders
 
 
-@dataclass
-class HTMLCacheKey:
-    """HTMLCacheKey is a cachable key in the HTML cache."""
-    name: str
-    amount_string: str
-    leftover: int
-    
-    def __hash__(self) -> int:
-        return hash((self.name, self.amount_string, self.leftover))
-    
-    
-@dataclass
-class HTMLResultCacheKey:
-    """HTMLResultCacheKey is a cachable key in the HTML result cache, for memoizing get_html."""
-    name: str
-    amount: int
-    leftover: int
-    depth: int
-    
-    def __hash__(self) -> int:
-        return hash((self.name, self.amount, self.leftover, self.depth))
+def to_script_json(value: Any) -> str:
+    """Converts a value to compact JSON that is safe to embed in a script tag."""
+    return json.dumps(value, separators=(",", ":")).replace("</", "<\\/")
+
+
+HTML_TEMPLATE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "templates", "results.html")
+"""Path to the template for the HTML results page. It has no network dependencies, and the node table gets written in place of the HTML_TEMPLATE_MARKER line."""
+
+
+HTML_TEMPLATE_MARKER = "<!-- NODE TABLE -->"
+"""Line in the HTML template that is replaced with the node table."""
+
+
+DepthDictionary = Dict[int, List[ItemStack]]
+"""DepthDictionaries map integer depths to a list of ItemStacks. They are used for calculating costs."""
 
 
 class App:
     """The App class manages the cost calculator app."""
-    def __init__(self, args: List[str]=[]) -> None:
-        clear()
+    def __init__(self, args: List[str]=[], clear_screen: bool=True, layers: Optional[PackLayers]=None, addons: Optional[List[str]]=None) -> None:
+        """args are the command line arguments. clear_screen can be turned off when the App is not being used interactively (such as in batch mode). layers can be passed to reuse packs that were already loaded by earlier Apps, so switching addons doesn't reload the pack. addons replaces the addons from the configs if it is given."""
+        if clear_screen:
+            clear()
+
+        # Profiling options are taken out first, so the rest of the arguments work the same as before
+        args, profiler = parse_profile_args(args)
+
+        self.profiler: PhaseProfiler = profiler
+        """Records the time and memory used by each phase of the run when --profile is passed."""
+
+        self.counters: Optional[EngineCounters] = EngineCounters() if "--counters" in args else None
+        """Counts the work done by the cost engine when --counters is passed. The counters are written to counters.json after the run."""
+
+        args = [arg for arg in args if arg != "--counters"]
 
         self.should_print_to_file: bool = len(args) > 1 and args[1] == "-o"
         """Should the cost calculator print outputs to an external file instead of stdout?"""
@@ -132,18 +145,25 @@ class App:
         if self.should_print_to_file:
             self.print_target = open(args[2], "w+")
 
-        self.config = load_main_config()
-        """The MainConfigFile instance for the pack."""
+        with self.profiler.phase("pack and addon load"):
+            self.config = load_main_config()
+            """The MainConfigFile instance for the pack."""
 
-        self.pack: PackConfigFile = load_pack_config(self.config.current_pack)
-        """The PackConfigFile used by the application, which is loaded from the current_pack value in the configs."""
+            addons = self.config.addons if addons is None else addons
 
-        # Gets the list of addons
-        addons = [load_pack_config(addon) for addon in self.config.addons]
+            # Already loaded layers are reused first, then the pack cache skips parsing the pack and addons if none of them changed since the last run
+            if layers is not None and layers.pack_path == self.config.current_pack:
+                self.pack: PackConfigFile = layers.resolve(addons)
+                """The PackConfigFile used by the application, which is loaded from the current_pack value in the configs and extended with the addons."""
+            elif self.config.use_pack_cache:
+                self.pack = load_cached_pack(self.config.current_pack, addons)
+            else:
+                self.pack = load_merged_pack(self.config.current_pack, addons)
+
+        self.pack.counters = self.counters
 
-        # Extends the pack with any addons
-        for addon in addons:
-            self.pack.extend_pack(addon)
+        # Warn about recipe loops up front, items affected by them are refused when calculating
+        print_recipe_loops(self.pack)
 
         # Gets other config options
         self.show_left_over_amount = self.config.show_left_over_amount
@@ -155,6 +175,9 @@ class App:
         self.show_crafting_bytes = self.config.show_crafting_bytes
         """Should the cost calculator display how many bytes AE2 would need to calculate the craft? (Assume that for fluids, 1000 mb of the fluid is treated as one item, this can also apply to life essence, demon will, essentia, or other things)"""
 
+        self.use_topological_engine = self.config.use_topological_engine
+        """Should the cost calculator use the single-pass topological engine instead of the recursive calculate_costs?"""
+
         # Stuff that isn't set immediately
         self.user_items: Dict[str, int] = {}
         """Dictionary of the amount of each item that the user asks how to craft."""
@@ -171,19 +194,32 @@ class App:
         self.preexisting_items_asked_about: Set[str] = set()
         """Set of preexisting items that the program has already asked the user about."""
 
-        # The 2 HTML caches are somewhat hackier to understand
-        self.html_cache: Dict[HTMLCacheKey, HTMLCacheKey | List[HTMLCacheKey]] = {}
-        """Cache that maps the key objects to either a list of keys or just 1 key."""
+        self.sub_craft_cache: Dict[Tuple[str, int], List[Tuple[str, int, int]]] = {}
+        """Cache of the sorted sub-crafts for each distinct (item, amount), used by write_html."""
         
-        self.html_result_cache: Dict[HTMLResultCacheKey, str] = {}
-        """Cache of precalculated results for get_html."""
-
         self.crafting_bytes = 0
         """How many crafting bytes does the recipe currently use?"""
 
         self.ae2_fluids = self.pack.get_ae2_fluids()
         """What AE2 fluids does the pack currently use? (for crafting byte calculation)"""
 
+        self.compiled: Optional[CompiledPack] = None
+        """Integer-indexed snapshot of the pack, created by load_recipes. Craftable items are numbered in topological order, which is what the single-pass engine runs over."""
+
+    def reset(self):
+        """Resets everything calculated for the previous order, so the App (and its loaded pack) can be reused for another order."""
+        self.user_items = {}
+        self.preexisting_items = {}
+        self.evaluated_items = {}
+        self.alt_sorting_depth = {}
+        self.preexisting_items_asked_about = set()
+        self.sub_craft_cache = {}
+        self.crafting_bytes = 0
+
+        if self.counters is not None:
+            self.counters = EngineCounters()
+            self.pack.counters = self.counters
+
     def print_output(self, string: str):
         """Prints a string to the output, which is either stdout or a file."""
         # self.print_target is an Optional so we still need to test if it exists
@@ -207,24 +243,20 @@ class App:
             if current_input == "-r":
                 break
 
-            # Skip blank lines
-            if current_input == "":
-                continue
-
-            item_stack = make_item_stack(current_input)
-
-            items_counter[item_stack.name] += item_stack.amount
+            add_item_to_counter(items_counter, current_input)
 
         print("")
 
         # Returns a new dictionary using the items in the counter
         return delete_zero_values(dict(items_counter))
 
-    def load_recipes(self):
-        """Loads all of the recipes from the current pack, setting their depth as required."""
-        for recipe in self.pack.get_recipes_list():
-            # Depth is how many crafting recipes are required to reach the deepest point of the recipe
-            recipe.depth = get_depth(self.pack, recipe)
+    def load_recipes(self, compiled_path: Optional[str]=None):
+        """Loads all of the recipes from the current pack, setting their depth as required. If compiled_path is given, the compiled pack is memory mapped from that file (see write_compiled_pack) instead of being compiled again."""
+        # Depth is how many crafting recipes are required to reach the deepest point of the recipe
+        self.pack.compute_depths()
+
+        # Compile the pack for the single-pass engine and the HTML renderer
+        self.compiled = compile_pack(self.pack) if compiled_path is None else open_compiled_pack(compiled_path)
 
     def get_max_depth(self, items: List[str]) -> int:
         """Gets the maximum depth contained in a list of items."""
@@ -241,18 +273,27 @@ class App:
 
             dct[depth].append(ItemStack(name, amount))
 
+        if self.counters is not None:
+            self.counters.depth_dictionary_rebuilds += 1
+            self.counters.item_stack_allocations += len(items)
+
         return dct
 
     def crafting_bytes_for_items(self, item: ItemStack) -> int:
         """Returns the number of bytes used for an ItemStack in crafting."""
         if item.name in self.ae2_fluids: # if the item is a fluid then divide by 1000 for the bytes
-            return math.ceil(item.amount / 1000)
+            return ceil_divide(item.amount, 1000)
         else:
             return item.amount
 
     # Calculates the costs of items
     def calculate_costs(self, items: Dict[str, int]) -> Dict[str, int]:
         """Calculates the total costs of a dictionary of items, returning a new dictionary of items."""
+        counters = self.counters
+
+        if counters is not None:
+            counters.calculate_costs_levels += 1
+
         max_depth = self.get_max_depth(list(items.keys()))
 
         # No items are craftable, so it returns instantly
@@ -278,11 +319,15 @@ class App:
                     # main_depth = recipe.depth
 
                     # adds number of times a recipe was done * 8 to the bytes amount
-                    self.crafting_bytes += math.ceil(item.amount / recipe.amount_produced) * 8
+                    self.crafting_bytes += ceil_divide(item.amount, recipe.amount_produced) * 8
+
+                    if counters is not None:
+                        counters.recipe_expansions += 1
+                        counters.item_stack_allocations += len(recipe.inputs)
 
                     # We track the alternate sorting depth regardless of if the config is enabled, the config only comes into play when it is time to actually display the results.
                     if item.name not in self.alt_sorting_depth:
-                        self.alt_sorting_depth[item.name] = recipe.depth
+                        self.alt_sorting_depth[item.name] = self.pack.get_recipe_depth(item.name)
                     
                     # main_sorting_depth is the alternate sorting depth of the current item being crafted
                     main_sorting_depth = self.get_alt_sorting_depth(item)
@@ -304,6 +349,9 @@ class App:
                             if sub_item.name not in self.evaluated_items:
                                 self.evaluated_items[sub_item.name] = ItemStack(sub_item.name, 0, depth)
 
+                                if counters is not None:
+                                    counters.item_stack_allocations += 1
+
                             # The new alternate sorting depth is the alternate sorting depth of the most recent item minus 1, unless the current sorting depth is greater
                             self.alt_sorting_depth[sub_item.name] = main_sorting_depth - 1 if (sub_item.name not in self.alt_sorting_depth or self.get_alt_sorting_depth(sub_item) > main_sorting_depth - 1) else self.get_alt_sorting_depth(sub_item)
 
@@ -329,6 +377,98 @@ class App:
 
             return self.calculate_costs(new_items)
 
+    def calculate_costs_topological(self, items: Dict[str, int]) -> Dict[str, int]:
+        """Calculates the total costs of a dictionary of items in a single pass over the compiled pack's topological order, returning a new dictionary of raw items. Produces the same results as calculate_costs, which is kept as a reference implementation."""
+        compiled = self.compiled
+        counters = self.counters
+
+        if compiled is None:
+            raise ValueError("load_recipes must be called before calculating costs!")
+
+        if counters is not None:
+            counters.calculate_costs_levels += 1
+
+        # Total demand for each craftable item (by id) that has not been expanded yet
+        demand: Dict[int, int] = {}
+
+        # Demand for items without recipes, which is what gets returned
+        raw_items: Dict[str, int] = {}
+
+        # Heap of the ids of items waiting to be expanded, so only the part of the recipe graph that is actually reached gets visited
+        pending: List[int] = []
+
+        for name, amount in items.items():
+            item_id = compiled.get_id(name)
+
+            if compiled.is_craftable(item_id):
+                if item_id not in demand:
+                    heapq.heappush(pending, item_id)
+                    demand[item_id] = 0
+
+                demand[item_id] += amount
+            else:
+                raw_items[name] = raw_items.get(name, 0) + amount
+
+        names = compiled.names
+        depths = compiled.depths
+        offsets = compiled.offsets
+        input_ids = compiled.input_ids
+        input_amounts = compiled.input_amounts
+
+        while len(pending) > 0:
+            # Every item that uses this item has a lower id, so its demand is complete by the time it is popped
+            item_id = heapq.heappop(pending)
+            amount = demand.pop(item_id)
+            name = names[item_id]
+            produced = compiled.produces[item_id]
+
+            # Crafting bytes work the same way as in calculate_costs
+            self.crafting_bytes += self.crafting_bytes_for_items(ItemStack(name, amount))
+
+            num_crafts = ceil_divide(amount, produced)
+            self.crafting_bytes += num_crafts * 8
+
+            if counters is not None:
+                counters.recipe_expansions += 1
+                counters.item_stack_allocations += 1
+
+            if name not in self.alt_sorting_depth:
+                self.alt_sorting_depth[name] = depths[item_id]
+
+            main_sorting_depth = self.alt_sorting_depth[name]
+
+            for index in range(offsets[item_id], offsets[item_id + 1]):
+                sub_id = input_ids[index]
+                sub_name = names[sub_id]
+
+                # Same as get_cost, but the number of crafts only has to be worked out once per recipe
+                needed_amount = num_crafts * input_amounts[index]
+
+                if not compiled.is_craftable(sub_id):
+                    raw_items[sub_name] = raw_items.get(sub_name, 0) + needed_amount
+                    continue
+
+                if sub_name not in self.evaluated_items:
+                    self.evaluated_items[sub_name] = ItemStack(sub_name, 0, depths[sub_id])
+
+                    if counters is not None:
+                        counters.item_stack_allocations += 1
+
+                self.evaluated_items[sub_name].amount += needed_amount
+
+                # The alternate sorting depth is the lowest of the alternate sorting depths of the items it is used for, minus 1
+                if sub_name not in self.alt_sorting_depth or self.alt_sorting_depth[sub_name] > main_sorting_depth - 1:
+                    self.alt_sorting_depth[sub_name] = main_sorting_depth - 1
+
+                # Accumulate the demand in place instead of rebuilding a depth dictionary
+                if sub_id not in demand:
+                    heapq.heappush(pending, sub_id)
+                    demand[sub_id] = 0
+
+                demand[sub_id] += needed_amount
+
+        return raw_items
+
     def max_depth_evaluated_items(self) -> int:
         """Returns the maximum depth among evaluated items."""
         if len(self.evaluated_items) > 0:
@@ -347,14 +487,40 @@ class App:
         """Gets the sorting depth for an item using the alternate method (the item it is used to craft that has the lowest depth)."""
         return self.alt_sorting_depth[item.name] if item.name in self.alt_sorting_depth else 0
 
+    def remove_loop_items(self, items: Dict[str, int]) -> Dict[str, int]:
+        """Returns a copy of a dictionary of items without any items that are part of (or use) a recipe loop, since their costs can't be calculated."""
+        result: Dict[str, int] = {}
+
+        for name, amount in items.items():
+            loop = self.pack.get_recipe_loop(name)
+
+            if loop is None:
+                result[name] = amount
+            else:
+                print(f"Can't calculate the cost of {name}, it uses the recipe loop {loop}")
+
+        return result
+
     def get_results(self, user_items: dict[str, int]) -> DepthDictionary:
         """Returns the results of calculations as a data structure. Needs to be passed a dictionary of user items."""
+        # Items affected by recipe loops are refused right away
+        user_items = self.remove_loop_items(user_items)
+
         # Copies the user items to a set of starting items to preserve them
         starting_items = user_items.copy()
 
-        # Calculates the costs of the user items
-        self.user_items = self.calculate_costs(user_items)
+        # Calculates the costs of the user items, using whichever engine is enabled in the configs
+        with self.profiler.phase("calculate_costs"):
+            if self.use_topological_engine:
+                self.user_items = self.calculate_costs_topological(user_items)
+            else:
+                self.user_items = self.calculate_costs(user_items)
+
+        with self.profiler.phase("get_results sorting"):
+            return self.sort_results(starting_items)
 
+    def sort_results(self, starting_items: Dict[str, int]) -> DepthDictionary:
+        """Sorts the results of the cost calculations into a DepthDictionary for displaying. Needs to be passed the dictionary of items the user originally asked for."""
         # Map depth of craft to item (ItemStack)
         results: DepthDictionary = defaultdict(list)
 
@@ -377,6 +543,9 @@ class App:
         # The original items have the highest depth because they need to be prominently displayed to the user
         stack_items = convert_to_stack_list(self.user_items)
 
+        if self.counters is not None:
+            self.counters.item_stack_allocations += len(starting_items) + len(stack_items)
+
         for item in sort_stack_list(stack_items):
             # Maximum depth is for the items that are used as part of crafts, but for the original items the depth must be even greater.
             results[max_depth + 1].append(item)
@@ -428,8 +597,19 @@ class App:
         if self.show_crafting_bytes:
             print(f"\nBytes used: {to_formatted_string(self.crafting_bytes)}")
 
+    def has_recipe(self, name: str) -> bool:
+        """Returns if an item has a recipe, using the compiled pack if it has been created."""
+        if self.compiled is not None:
+            return self.compiled.has_recipe(name)
+        else:
+            return self.pack.has_recipe(name)
+
     def simplified_calculate_cost(self, name: str, amount: int) -> Dict[str, Tuple[int, int]]:
         """A simplified variant of cost calculation which just maps names to a tuple containing the amount of items and the amount of leftover items in the craft. It only does 1 step of cost calculation at a time. This is mainly designed to be used for the HTML-writing features."""
+        # The compiled pack avoids creating any ItemStacks
+        if self.compiled is not None:
+            return self.compiled.simplified_calculate_cost(name, amount)
+
         recipe = self.pack.get_recipe(name)
         
         if recipe is None:
@@ -458,153 +638,61 @@ class App:
 
             return result
 
-    def get_html(self, name: str, amount: int, leftover: int=0, depth: int=0) -> str:
-        """Returns the HTML to display for an item."""
-        # check if item is uncraftable or is already in the result cache
-        if not self.pack.has_recipe(name):
-            return ""
-        else:
-            entry = HTMLResultCacheKey(name, amount, leftover, depth)
-            
-            if entry in self.html_result_cache:
-                return self.html_result_cache[entry]
-            
-        self.evaluated_items = {}
-
-        # Calculate the costs in a simplified manner
-        results = self.simplified_calculate_cost(name, amount)
-
-        # Set up the HTML to display
-        result = "<div>"
-
-        # What should be added to the HTML cache?
-        cache_result: List[HTMLCacheKey] = []
+    def get_sorted_sub_crafts(self, name: str, amount: int) -> List[Tuple[str, int, int]]:
+        """Returns (name, amount, leftover) for each input of a craft, sorted with items with recipes first, then by amount, then alphabetically. Each distinct (item, amount) is only calculated once."""
+        key = (name, amount)
 
-        # Sorting works differently for (str, int): prioritize items with recipes, amounts, alphabetical
-        for item_name, item_tuple in sorted(
-            sorted(
-                sorted(list(results.items()), key=lambda n: n[0]), 
-                key=lambda n: n[1][0],  reverse=True), 
-                key=lambda n: self.pack.has_recipe(n[0]), reverse=True):
-
-            item_amount, item_leftover = item_tuple
-
-            xpstring = to_formatted_string(item_amount)
-
-            inner_html = self.get_html(item_name, item_amount, item_leftover, depth + 1)
-
-            new_element = f"<div class='depth'"
-
-            # Is the inner HTML empty? (no more nesting)
-            is_empty = inner_html == ""
-            
-            cache_key = HTMLCacheKey(item_name, xpstring, item_leftover)
-
-            if is_empty:
-                self.html_cache[cache_key] = cache_key
-                new_element += f"> {xpstring} {item_name}\n"
+        if self.counters is not None:
+            if key in self.sub_craft_cache:
+                self.counters.sub_craft_cache_hits += 1
             else:
-                # Symbol /// is required to ensure splitting works properly with formatted exponent strings
-                # This is definitely some of the hackiest code in this codebase
-                new_element += f" class='htmlid'><div class='toggleid'>{xpstring} {item_name}{f' ({item_leftover} left over)' if self.show_left_over_amount and item_leftover > 0 else ''} [+]</div><div style='display: none;'>{item_name}///{xpstring}///{item_leftover}</div>"
+                self.counters.sub_craft_cache_misses += 1
 
-            cache_result.append(cache_key)
+        if key not in self.sub_craft_cache:
+            results = self.simplified_calculate_cost(name, amount)
 
-            result += new_element + "</div>\n"
-        
-        self.html_cache[HTMLCacheKey(name, to_formatted_string(amount), leftover)] = cache_result
-        
-        result += "</div>\n"
-        
-        self.html_result_cache[HTMLResultCacheKey(name, amount, leftover, depth)] = result
+            self.sub_craft_cache[key] = [(item_name, item_amount, item_leftover) for item_name, (item_amount, item_leftover) in sorted(
+                sorted(
+                    sorted(list(results.items()), key=lambda n: n[0]), 
+                    key=lambda n: n[1][0],  reverse=True), 
+                    key=lambda n: self.has_recipe(n[0]), reverse=True)]
 
-        return result
+        return self.sub_craft_cache[key]
 
     def write_html(self, items: Dict[str, int]):
-        """Writes an HTML file from the dictionary of user items provided."""
-        fs = open("results.html", "w+")
+        """Writes an HTML file from the dictionary of user items provided. The crafting tree is streamed into the file as a flat JSON table of nodes (one per distinct item, amount and leftover), which the page (templates/results.html) renders as needed."""
+        with open(HTML_TEMPLATE_PATH, "r", encoding="utf-8") as template:
+            header, footer = template.read().split(HTML_TEMPLATE_MARKER)
 
-        fs.write("""<html><body><script
-src="https://code.jquery.com/jquery-3.6.1.js"
-  integrity="sha256-3zlB5s2uwoUzrXK3BT7AX3FyvojsraNFxCc2vC/7pNI="
-  crossorigin="anonymous"></script><style>html { font-family: monospace, monospace; color: rgb(85, 255, 85); background-color: black; width: 100%; overflow: auto; -ms-overflow-style: none; scrollbar-width: none; } html::-webkit-scrollbar {display: none;} .depth {margin-left: 60px;} div { user-select:none; font-size: 20px; margin-top: 5px; margin-bottom: 5px; width: 100%; margin-left: 0px; } .toggleid:hover { background-color: rgb(25, 25, 25); }</style>""")
+        with open("results.html", "w+", encoding="utf-8") as fs:
+            fs.write(header)
 
-        for name, amount in items.items():
-            fs.write(f"\n<div class='root'>{amount} {name}</div>{self.get_html(name, amount)}")
+            # Node ids are handed out as nodes are found, and nodes are written in the same order so that the table never has to be kept in memory
+            node_ids: Dict[Tuple[str, int, int], int] = {}
+            queue: Deque[Tuple[str, int, int]] = deque()
 
-        # Create string from key
-        def key_string(k: HTMLCacheKey) -> str:
-            return f"{k.name}///{k.amount_string}///{k.leftover}"
+            def get_node_id(key: Tuple[str, int, int]) -> int:
+                if key not in node_ids:
+                    node_ids[key] = len(node_ids)
+                    queue.append(key)
 
-        # let's set up the cache
-        string_arr: List[str] = []
+                return node_ids[key]
 
-        for k, v in self.html_cache.items():
-            if type(v) == list:
-                string_arr.append(f"cache[\"{key_string(k)}\"] = {[key_string(i) for i in v]};\n")
+            roots = [(f"{amount} {name}", get_node_id((name, amount, 0))) for name, amount in items.items()]
 
-        fs.write(f"""
-            <script>
-            let cache = {{}};
-            {"".join(string_arr)}\n
-            </script>\n
-        """)
+            fs.write("<script>\nconst nodes = [\n")
 
-        # script for buttons (yes this code is as bad as it looks)
-        fs.write(f"""
-        <script>
-            // add elements for all children
-            function addElements(elem) {{
-                let child = elem.parent().children().eq(1);
+            while len(queue) > 0:
+                name, amount, leftover = queue.popleft()
 
-                if (child[0] === undefined)
-                    return;
+                # Each node is [name, amount string, leftover, child ids], with null children for items that don't have recipes
+                children = [get_node_id(sub_craft) for sub_craft in self.get_sorted_sub_crafts(name, amount)] if self.has_recipe(name) else None
 
-                let name = child.html();
+                fs.write(to_script_json([name, to_formatted_string(amount), leftover, children]) + ",\n")
 
-                if (!(name in cache))
-                    return;
-
-                let centry = cache[name];
-                
-                // Add onto the children
-                child.remove(); 
-                
-                centry.forEach(entry => {{
-                    let element = $(`<div></div>`);
-					let split = entry.split("///");
-
-                    let amount = split[split.length - 2];
-                    let leftover = split[split.length - 1];
-					let name = split.slice(0, -2).join(" ");
-					
-					if (entry in cache) {{
-						element.html(`<div class="depth htmlid"><div class="toggleid">${{amount}} ${{name}}{('${parseInt(leftover) > 0 ? ` (${leftover} left over)` : ""}') if self.show_left_over_amount else ""} [+]</div><div style="display: none;">${{name}}///${{amount}}///${{leftover}}</div></div>`);
-					}} else {{
-						element = $(`<div class="depth"> ${{amount}} ${{name}}</div>`);
-					}}
-                    
-                    elem.parent().append(element);
-                }});
-            }}
-
-            $(document).on("click", event => {{
-                let elem = $(event.target);
-                            
-                if (elem.attr("class") === "toggleid") {{
-                    // toggle child elements, update symbol to + or - depending on circumstance
-                    elem.text(elem.text().slice(0, -3) + (elem.parent().children().eq(1).is(':visible') ? '[+]' : '[-]'))
-                    elem.parent().children().slice(1).toggle();
+            fs.write(f"];\nconst roots = {to_script_json(roots)};\nconst showLeftover = {to_script_json(self.show_left_over_amount)};\n</script>\n")
 
-
-                    // create new elements if needed
-                    addElements(elem);
-                }}
-            }});
-        </script>
-        """)
-
-        fs.write("</body></html>")
+            fs.write(footer)
 
     def init(self):
         """Runs the application."""
@@ -613,20 +701,130 @@ src="https://code.jquery.com/jquery-3.6.1.js"
         starting_items = self.user_items.copy()
 
         # Loads the pack's recipes
-        self.load_recipes()
+        with self.profiler.phase("load_recipes"):
+            self.load_recipes()
 
         # Gets and displays the results from the calculations
         results = self.get_results(self.user_items)
 
-        self.print_results(results)
+        with self.profiler.phase("print_results"):
+            self.print_results(results)
 
         # Write the HTML output if that config is enabled
         if self.config.html_output:
-            self.write_html(starting_items)
+            with self.profiler.phase("write_html"):
+                self.write_html(starting_items)
+
+        # Displays the profile if profiling is enabled
+        if self.profiler.enabled:
+            print(self.profiler.finish())
+
+        # Writes the counters next to the other results if they are enabled
+        if self.counters is not None:
+            self.write_counters("counters.json")
+            print("\nSaved counters to counters.json")
+
+    def write_counters(self, path: str):
+        """Writes the hot-path counters to a JSON file. Does nothing if counters are not enabled."""
+        if self.counters is None:
+            return
+
+        with open(path, "w+") as f:
+            f.write(self.counters.to_json())
     
 
+batch_worker_layers: Optional[PackLayers] = None
+"""The pack and addons loaded by a batch mode worker process. They are loaded once per process, and each set of addons is layered over the same pack."""
+
+batch_worker_apps: Dict[Tuple[str, ...], App] = {}
+"""The Apps used by a batch mode worker process for each set of addons, which are created the first time the worker gets an order for that set."""
+
+batch_worker_compiled_paths: Dict[Tuple[str, ...], str] = {}
+"""Paths of the compiled packs for each set of addons, written by run_batch."""
+
+
+def init_batch_worker(compiled_paths: Dict[Tuple[str, ...], str]={}):
+    """Initializes a batch mode worker process. compiled_paths maps sets of addons to compiled pack files (see write_compiled_pack), which the worker memory maps instead of compiling the pack itself, so every worker shares one copy of each."""
+    global batch_worker_layers, batch_worker_compiled_paths
+
+    config = load_main_config()
+
+    batch_worker_layers = PackLayers(config.current_pack, config.use_pack_cache)
+    batch_worker_compiled_paths = compiled_paths
+    batch_worker_apps.clear()
+
+
+def get_batch_worker_app(addons: Tuple[str, ...]) -> App:
+    """Gets the App a batch mode worker uses for a set of addons, creating it if needed. Only the addons have to be loaded, since the pack is shared between every set."""
+    if batch_worker_layers is None:
+        init_batch_worker()
+
+    app = batch_worker_apps.get(addons)
+
+    if app is None:
+        app = App(clear_screen=False, layers=batch_worker_layers, addons=list(addons))
+        app.load_recipes(batch_worker_compiled_paths.get(addons))
+
+        batch_worker_apps[addons] = app
+
+    return app
+
+
+def evaluate_batch_order(order: BatchOrder) -> str:
+    """Evaluates one order in a batch mode worker process, returning what the calculator would have printed for it."""
+    addons, items = order
+
+    app = get_batch_worker_app(addons)
+    app.reset()
+
+    output = io.StringIO()
+
+    with contextlib.redirect_stdout(output):
+        results = app.get_results(items.copy())
+        app.print_results(results)
+
+    return output.getvalue()
+
+
+def run_batch(orders_path: str, output_path: Optional[str]=None, max_workers: Optional[int]=None):
+    """Runs the calculator on every order in an orders file, spreading the orders across a pool of worker processes. Results are written in the same order as the orders file, either to stdout or to the output file if one is given."""
+    config = load_main_config()
+    orders = parse_orders_file(orders_path, config.addons)
+
+    # The pack is loaded once, and every set of addons in the file is layered over it and compiled to a binary file, which the workers memory map instead of compiling the pack themselves
+    layers = PackLayers(config.current_pack, config.use_pack_cache)
+
+    compiled_directory = tempfile.TemporaryDirectory()
+    compiled_paths: Dict[Tuple[str, ...], str] = {}
+
+    for addons, _ in orders:
+        if addons not in compiled_paths:
+            compiled_paths[addons] = os.path.join(compiled_directory.name, f"pack-{len(compiled_paths)}.compiled")
+
+            write_compiled_pack(compile_pack(layers.resolve(list(addons))), compiled_paths[addons])
+
+    target = sys.stdout if output_path is None else open(output_path, "w+")
+
+    try:
+        with ProcessPoolExecutor(max_workers=max_workers, initializer=init_batch_worker, initargs=(compiled_paths,)) as executor:
+            # Orders are handed out in chunks so that small orders don't spend most of their time waiting on the pool
+            chunksize = max(1, len(orders) // ((max_workers or os.cpu_count() or 1) * 4))
+
+            for index, ((_, items), output) in enumerate(zip(orders, executor.map(evaluate_batch_order, orders, chunksize=chunksize))):
+                target.write(f"Order {index + 1}: {', '.join([f'{amount} {name}' for name, amount in items.items()])}\n{output}\n")
+    finally:
+        if output_path is not None:
+            target.close()
+
+        compiled_directory.cleanup()
+
+
 # Start the program
 if __name__ == "__main__":
-    app = App(sys.argv)
+    # Batch mode: calculator.py -b orders_file [output_file]
+    if len(sys.argv) > 2 and sys.argv[1] == "-b":
+        run_batch(sys.argv[2], sys.argv[3] if len(sys.argv) > 3 else None)
+    else:
+        app = App(sys.argv)
 
-    app.init()
+        app.init()
@@ -0,0 +1,347 @@
+import mmap
+import os
+import struct
+import tempfile
+from array import array
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Set, Tuple, Union, overload
+
+
+from utils import *
+
+
+class CompiledPack:
+    """CompiledPack is a read-only, integer-indexed snapshot of a PackConfigFile.
+
+    Every item name is interned to an integer id, and the recipes are stored CSR-style in flat arrays: the inputs of the item with id i are input_ids[offsets[i]:offsets[i + 1]], with the matching amounts in input_amounts.
+
+    Craftable items get the ids 0 to craftable_count - 1, in topological order (highest depth first), so an item always has a lower id than the items used to craft it. Items without recipes get the remaining ids."""
+    def __init__(self, names: Sequence[str], craftable_count: int, offsets: Sequence[int], input_ids: Sequence[int], input_amounts: Sequence[int], produces: Sequence[int], depths: Sequence[int], loop_items: List[str], ids: Optional[Any]=None):
+        self.names = names
+        """Maps item ids to item names."""
+
+        self.ids: Dict[str, int] = {name: item_id for item_id, name in enumerate(names)} if ids is None else ids
+        """Maps item names to item ids. Anything with a dictionary-style get method works, which is how packs opened with open_compiled_pack avoid building a dictionary."""
+
+        self.craftable_count = craftable_count
+        """How many items have recipes? These items have the lowest ids."""
+
+        self.offsets = offsets
+        """Offsets into input_ids/input_amounts for each item, with one extra entry at the end. Items without recipes have an empty range."""
+
+        self.input_ids = input_ids
+        """Ids of the inputs of every recipe, stored back to back."""
+
+        self.input_amounts = input_amounts
+        """How many of each input is required per craft, matching input_ids."""
+
+        self.produces = produces
+        """How many of each item a craft produces (0 for items without recipes)."""
+
+        self.depths = depths
+        """Depth of the recipe for each item (0 for items without recipes)."""
+
+        self.loop_items = loop_items
+        """Items that could not be ordered because they are part of (or depend on) a recipe loop. They are compiled as if they had no recipe."""
+
+    def get_id(self, name: str) -> int:
+        """Returns the id of an item, or -1 if the item does not appear in the pack."""
+        return self.ids.get(name, -1)
+
+    def is_craftable(self, item_id: int) -> bool:
+        """Returns if the item with the given id has a recipe."""
+        return 0 <= item_id < self.craftable_count
+
+    def has_recipe(self, name: str) -> bool:
+        """Returns if the pack has a recipe for the item with the given name."""
+        return self.is_craftable(self.get_id(name))
+
+    def get_recipe_depth(self, name: str) -> int:
+        """Gets the depth of the recipe for an item. If the recipe does not exist, it returns 0."""
+        item_id = self.get_id(name)
+
+        return self.depths[item_id] if item_id >= 0 else 0
+
+    def get_inputs(self, item_id: int) -> Iterator[Tuple[int, int]]:
+        """Returns an iterator of (input id, amount per craft) for the recipe of the given item."""
+        start, end = self.offsets[item_id], self.offsets[item_id + 1]
+
+        return zip(self.input_ids[start:end], self.input_amounts[start:end])
+
+    def get_leftover(self, item_id: int, amount: int) -> int:
+        """Returns how many of an item are left over after crafting the given amount of it."""
+        if not self.is_craftable(item_id):
+            return 0
+
+        mod = amount % self.produces[item_id]
+
+        return self.produces[item_id] - mod if mod > 0 else 0
+
+    def simplified_calculate_cost(self, name: str, amount: int) -> Dict[str, Tuple[int, int]]:
+        """Does 1 step of cost calculation for an item, mapping the names of its inputs to a tuple containing the amount of items and the amount of leftover items. Works the same as App.simplified_calculate_cost."""
+        item_id = self.get_id(name)
+
+        result: Dict[str, Tuple[int, int]] = {}
+
+        if not self.is_craftable(item_id):
+            return result
+
+        produces = self.produces[item_id]
+
+        for input_id, input_amount in self.get_inputs(item_id):
+            new_amount = ceil_divide(amount, produces) * input_amount
+
+            result[self.names[input_id]] = (new_amount, self.get_leftover(input_id, new_amount))
+
+        return result
+
+    def get_all_raw_materials(self, name: str) -> Set[str]:
+        """Gets the set of all the raw materials used to craft an item."""
+        item_id = self.get_id(name)
+
+        if not self.is_craftable(item_id):
+            return {name}
+
+        # Craftable items always come before their inputs, so walking the reachable items by id visits them in topological order
+        seen = {item_id}
+        stack = [item_id]
+        result: Set[str] = set()
+
+        while len(stack) > 0:
+            current = stack.pop()
+
+            for input_id, _ in self.get_inputs(current):
+                if input_id in seen:
+                    continue
+
+                seen.add(input_id)
+
+                if self.is_craftable(input_id):
+                    stack.append(input_id)
+                else:
+                    result.add(self.names[input_id])
+
+        return result
+
+
+def compile_pack(pack: PackConfigFile) -> CompiledPack:
+    """Compiles a PackConfigFile into a CompiledPack, using the depths cached by the pack."""
+    recipes = dict(pack.get_recipes_iterable())
+
+    # The pack caches depths itself, so this only does work for recipes that changed since the last time
+    pack.compute_depths()
+
+    depths: Dict[str, int] = {name: pack.depths[name] for name in recipes if name in pack.depths}
+
+    # Items stuck behind a recipe loop can't be ordered, so they are compiled as if they had no recipe
+    loop_items = sorted([name for name in recipes if name not in depths])
+
+    # Craftable items are sorted by depth (highest first), then alphabetically
+    craftable = sorted(sorted(depths.keys()), key=lambda name: depths[name], reverse=True)
+
+    uncraftable: Set[str] = set(loop_items)
+
+    for name in craftable:
+        for stack in recipes[name].inputs:
+            if stack.name not in depths:
+                uncraftable.add(stack.name)
+
+    names = [sys.intern(name) for name in craftable + sorted(uncraftable)]
+    ids = {name: item_id for item_id, name in enumerate(names)}
+
+    offsets = array("q", [0])
+    input_ids = array("q")
+    input_amounts = array("q")
+    produces = array("q", [0] * len(names))
+    depth_array = array("q", [0] * len(names))
+
+    for item_id, name in enumerate(craftable):
+        recipe = recipes[name]
+
+        for stack in recipe.inputs:
+            input_ids.append(ids[stack.name])
+            input_amounts.append(stack.amount)
+
+        offsets.append(len(input_ids))
+        produces[item_id] = recipe.amount_produced
+        depth_array[item_id] = depths[name]
+
+    # Items without recipes have empty input ranges
+    offsets.extend([len(input_ids)] * (len(names) - len(craftable)))
+
+    return CompiledPack(names, len(craftable), offsets, input_ids, input_amounts, produces, depth_array, loop_items)
+
+
+COMPILED_PACK_MAGIC = b"CALCPACK"
+"""First 8 bytes of a compiled pack file."""
+
+COMPILED_PACK_VERSION = 1
+"""Version of the compiled pack file format."""
+
+COMPILED_PACK_HEADER = struct.Struct("<8s6q")
+"""Header of a compiled pack file: magic, version, number of names, craftable count, number of edges, number of loop items and size of the string data."""
+
+
+class _StringTable(Sequence[str]):
+    """_StringTable is a read-only list of strings stored back to back as UTF-8 in a compiled pack file. Strings are only decoded the first time they are used, and kept after that."""
+    def __init__(self, data: Any, offsets: Any, start: int, count: int):
+        self.data = data
+        """The bytes (usually an mmap) holding the strings."""
+
+        self.offsets = offsets
+        """Offsets of each string into data, with one extra entry at the end."""
+
+        self.start = start
+        """Index of the first string of this table in offsets."""
+
+        self.size = count
+        """Number of strings in the table."""
+
+        self.decoded: List[Optional[str]] = [None] * count
+        """Strings that have been decoded so far, so hot loops over the same items don't decode them again for every order."""
+
+    def __len__(self) -> int:
+        return self.size
+
+    @overload
+    def __getitem__(self, index: int) -> str: ...
+
+    @overload
+    def __getitem__(self, index: slice) -> List[str]: ...
+
+    def __getitem__(self, index: Union[int, slice]) -> Union[str, List[str]]:
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(self.size))]
+
+        string = self.decoded[index] if 0 <= index < self.size else None
+
+        if string is None:
+            string = sys.intern(self.get_bytes(index).decode("utf-8"))
+            self.decoded[index] = string
+
+        return string
+
+    def __iter__(self) -> Iterator[str]:
+        for index in range(self.size):
+            yield self[index]
+
+    def get_bytes(self, index: int) -> bytes:
+        """Gets the raw UTF-8 bytes of a string."""
+        if not 0 <= index < self.size:
+            raise IndexError("string table index out of range")
+
+        return bytes(self.data[self.offsets[self.start + index]:self.offsets[self.start + index + 1]])
+
+
+class _NameIndex:
+    """_NameIndex maps item names to ids by binary searching a list of ids sorted by name, so opening a compiled pack doesn't need to build a dictionary."""
+    def __init__(self, names: _StringTable, sorted_ids: Any):
+        self.names = names
+        """The names of the items."""
+
+        self.sorted_ids = sorted_ids
+        """Item ids, sorted by the UTF-8 bytes of their names."""
+
+    def get(self, name: str, default: int=-1) -> int:
+        """Gets the id of an item, or default if the item is not in the pack."""
+        key = name.encode("utf-8")
+        low, high = 0, len(self.sorted_ids)
+
+        while low < high:
+            middle = (low + high) // 2
+
+            if self.names.get_bytes(self.sorted_ids[middle]) < key:
+                low = middle + 1
+            else:
+                high = middle
+
+        if low < len(self.sorted_ids) and self.names.get_bytes(self.sorted_ids[low]) == key:
+            return self.sorted_ids[low]
+
+        return default
+
+    def __contains__(self, name: str) -> bool:
+        return self.get(name) >= 0
+
+    def __getitem__(self, name: str) -> int:
+        item_id = self.get(name)
+
+        if item_id < 0:
+            raise KeyError(name)
+
+        return item_id
+
+
+def write_compiled_pack(compiled: CompiledPack, path: str):
+    """Writes a CompiledPack to a flat binary file that can be opened with open_compiled_pack. The file is a build artifact: the YAML pack it was compiled from stays the source of truth.
+
+    After the header come int64 arrays (offsets, input ids, input amounts, produces, depths, string offsets and the ids sorted by name), followed by the UTF-8 names and loop items."""
+    encoded = [name.encode("utf-8") for name in list(compiled.names) + compiled.loop_items]
+
+    string_offsets = array("q", [0])
+
+    for name in encoded:
+        string_offsets.append(string_offsets[-1] + len(name))
+
+    sorted_ids = array("q", sorted(range(len(compiled.names)), key=lambda item_id: encoded[item_id]))
+
+    header = COMPILED_PACK_HEADER.pack(COMPILED_PACK_MAGIC, COMPILED_PACK_VERSION, len(compiled.names), compiled.craftable_count, len(compiled.input_ids), len(compiled.loop_items), string_offsets[-1])
+
+    # Written to a temporary file first, so processes opening the file never see half of it
+    directory = os.path.dirname(os.path.abspath(path))
+    handle, temp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+
+    try:
+        with os.fdopen(handle, "wb") as file:
+            file.write(header)
+
+            for values in [compiled.offsets, compiled.input_ids, compiled.input_amounts, compiled.produces, compiled.depths, string_offsets, sorted_ids]:
+                file.write(array("q", values).tobytes())
+
+            file.write(b"".join(encoded))
+
+        os.replace(temp_path, path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+
+
+def open_compiled_pack(path: str) -> CompiledPack:
+    """Opens a file written by write_compiled_pack. The file is memory mapped read-only, so processes opening the same file share one copy of it and nothing is parsed up front."""
+    with open(path, "rb") as file:
+        data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    magic, version, name_count, craftable_count, edge_count, loop_count, string_size = COMPILED_PACK_HEADER.unpack_from(data, 0)
+
+    if magic != COMPILED_PACK_MAGIC or version != COMPILED_PACK_VERSION:
+        raise ValueError(f"{path} is not a compiled pack file for this version of the calculator")
+
+    view = memoryview(data)
+    position = COMPILED_PACK_HEADER.size
+
+    def take(count: int) -> Any:
+        """Takes the next int64 array of the file."""
+        nonlocal position
+
+        section = view[position:position + count * 8].cast("q")
+        position += count * 8
+
+        return section
+
+    offsets = take(name_count + 1)
+    input_ids = take(edge_count)
+    input_amounts = take(edge_count)
+    produces = take(name_count)
+    depths = take(name_count)
+    string_offsets = take(name_count + loop_count + 1)
+    sorted_ids = take(name_count)
+
+    if position + string_size != len(data):
+        raise ValueError(f"{path} is truncated or corrupted")
+
+    # The string offsets are relative to the start of the string data
+    strings = view[position:]
+
+    names = _StringTable(strings, string_offsets, 0, name_count)
+    loop_items = list(_StringTable(strings, string_offsets, name_count, loop_count))
+
+    return CompiledPack(names, craftable_count, offsets, input_ids, input_amounts, produces, depths, loop_items, _NameIndex(names, sorted_ids))
@@ -0,0 +1,236 @@
+import hashlib
+import json
+import os
+import pickle
+import tempfile
+from typing import Any, Dict, List, Optional, Tuple
+
+
+from utils import *
+
+
+PACK_CACHE_DIRECTORY = ".pack-cache"
+"""Directory the parsed pack caches are stored in."""
+
+PACK_CACHE_VERSION = 9
+"""Version of the cache format. Bump this whenever PackConfigFile or CraftingRecipe change shape, so old caches get thrown away."""
+
+
+SourceStamp = Tuple[str, int, int, str]
+"""(absolute path, mtime in nanoseconds, size, sha256 of the contents) for a source file of a cached pack."""
+
+
+def get_source_stamp(path: str) -> SourceStamp:
+    """Gets the stamp of a source file, which is compared against the stamp saved with the cache."""
+    stat = os.stat(path)
+
+    with open(path, "rb") as file:
+        digest = hashlib.sha256(file.read()).hexdigest()
+
+    return (os.path.abspath(path), stat.st_mtime_ns, stat.st_size, digest)
+
+
+def get_pack_stamps(path: str) -> List[SourceStamp]:
+    """Gets the stamps of a pack file and its journal (if it has one), since unsaved edits in the journal are part of the pack as well."""
+    journal_path = get_journal_path(path)
+
+    return [get_source_stamp(path)] + ([get_source_stamp(journal_path)] if os.path.exists(journal_path) else [])
+
+
+def get_cache_path(paths: List[str]) -> str:
+    """Gets the path of the cache file for a pack and its addons. Each combination of files gets its own cache, so switching packs doesn't throw away the other caches."""
+    key = "\n".join([os.path.abspath(path) for path in paths])
+
+    return os.path.join(PACK_CACHE_DIRECTORY, hashlib.sha256(key.encode("utf-8")).hexdigest()[:16] + ".pickle")
+
+
+def read_pack_cache(cache_path: str, stamps: List[SourceStamp]) -> Optional[PackConfigFile]:
+    """Reads a cached pack, returning None if there is no cache or it is out of date."""
+    try:
+        with open(cache_path, "rb") as file:
+            data: Dict[str, Any] = pickle.load(file)
+    except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ImportError, ValueError):
+        # A missing or broken cache is just a cache miss
+        return None
+
+    if data.get("version") != PACK_CACHE_VERSION or data.get("sources") != stamps:
+        return None
+
+    return data["pack"]
+
+
+def write_pack_cache(cache_path: str, stamps: List[SourceStamp], pack: PackConfigFile):
+    """Writes a cached pack. The cache is written to a temporary file first, so a crash can never leave half a cache behind."""
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+
+    # Counters belong to a run, not to the pack
+    counters = pack.counters
+    pack.counters = None
+
+    try:
+        handle, temp_path = tempfile.mkstemp(dir=os.path.dirname(cache_path), suffix=".tmp")
+
+        with os.fdopen(handle, "wb") as file:
+            pickle.dump({"version": PACK_CACHE_VERSION, "sources": stamps, "pack": pack}, file, pickle.HIGHEST_PROTOCOL)
+
+        os.replace(temp_path, cache_path)
+    except OSError as e:
+        # The cache is only an optimization, so failing to write it shouldn't stop the calculator
+        print(f"Could not write the pack cache: {e}")
+    finally:
+        pack.counters = counters
+
+
+def load_merged_pack(pack_path: str, addon_paths: List[str]) -> PackConfigFile:
+    """Loads a pack and extends it with its addons, without using the cache."""
+    pack = load_pack_config(pack_path)
+
+    for addon_path in addon_paths:
+        pack.extend_pack(load_pack_config(addon_path))
+
+    return pack
+
+
+def load_cached_pack(pack_path: str, addon_paths: List[str]) -> PackConfigFile:
+    """Loads a pack extended with its addons, like load_pack_config and extend_pack, but reuses the parsed and merged recipes from the last run if none of the files changed.
+
+    The cache is invalidated if the mtime, size or contents of the pack, any of the addons or their journals change."""
+    paths = [pack_path] + addon_paths
+
+    # load_pack_config creates missing packs, so there is nothing to cache until they exist
+    if not all([os.path.exists(path) for path in paths]):
+        return load_merged_pack(pack_path, addon_paths)
+
+    stamps = [stamp for path in paths for stamp in get_pack_stamps(path)]
+    cache_path = get_cache_path(paths)
+
+    pack = read_pack_cache(cache_path, stamps)
+
+    if pack is not None:
+        return pack
+
+    pack = load_merged_pack(pack_path, addon_paths)
+
+    # Loops and depths are cached as well, so warm runs don't need to work them out again
+    pack.compute_depths()
+
+    write_pack_cache(cache_path, stamps, pack)
+
+    return pack
+
+
+FileVersion = Tuple[int, int, int, int]
+"""(mtime in nanoseconds, size) of a pack file followed by the same for its journal (0, 0 if there is none). Cheap to get, and changes whenever the pack is saved or edited."""
+
+
+def get_file_version(path: str) -> FileVersion:
+    """Gets the version of a pack file and its journal."""
+    stat = os.stat(path)
+    journal_path = get_journal_path(path)
+
+    if os.path.exists(journal_path):
+        journal_stat = os.stat(journal_path)
+
+        return (stat.st_mtime_ns, stat.st_size, journal_stat.st_mtime_ns, journal_stat.st_size)
+
+    return (stat.st_mtime_ns, stat.st_size, 0, 0)
+
+
+class PackLayers:
+    """PackLayers keeps a pack and its addons loaded as separate, untouched layers, and resolves them into merged packs for any combination of addons.
+
+    Switching to a different set of addons only layers those addons over the already loaded pack (see PackConfigFile.with_addons), and each combination is only resolved once. Layers whose files changed are loaded again the next time they are used."""
+    def __init__(self, pack_path: str, use_cache: bool=False):
+        self.pack_path = pack_path
+        """Path to the base pack."""
+
+        self.use_cache = use_cache
+        """Should layers be loaded through the pack cache (see load_cached_pack)?"""
+
+        self.layers: Dict[str, Tuple[FileVersion, PackConfigFile]] = {}
+        """Loaded packs (the base pack and every addon used so far) by path, along with the version of the file they were loaded from."""
+
+        self.resolved: Dict[Tuple[str, ...], PackConfigFile] = {}
+        """Merged packs by the addon paths they were resolved with, in order."""
+
+    def get_layer(self, path: str) -> PackConfigFile:
+        """Gets the loaded pack for a path, loading it if it wasn't loaded yet or the file changed since. Resolved packs using an outdated layer are thrown away."""
+        # load_pack_config creates missing packs, so there is nothing to compare until it exists
+        version = get_file_version(path) if os.path.exists(path) else None
+        layer = self.layers.get(path)
+
+        if layer is not None and layer[0] == version:
+            return layer[1]
+
+        if layer is not None:
+            self.resolved = {key: pack for key, pack in self.resolved.items() if path != self.pack_path and path not in key}
+
+        if self.use_cache:
+            pack = load_cached_pack(path, [])
+        else:
+            pack = load_pack_config(path)
+
+            # Depths for the base pack are worked out once here, so every combination of addons gets to reuse them
+            if path == self.pack_path:
+                pack.compute_depths()
+
+        self.layers[path] = (get_file_version(path), pack)
+
+        return pack
+
+    def resolve(self, addon_paths: List[str]) -> PackConfigFile:
+        """Gets the pack extended with the given addons, in order. The result is shared between callers asking for the same addons, so it shouldn't be changed (use with_addons([]) on it to get a copy that can be)."""
+        base = self.get_layer(self.pack_path)
+        addons = [self.get_layer(path) for path in addon_paths]
+
+        key = tuple(addon_paths)
+        pack = self.resolved.get(key)
+
+        if pack is None:
+            pack = base.with_addons(addons)
+            self.resolved[key] = pack
+
+        return pack
+
+
+TRIE_CACHE_VERSION = 2
+"""Version of the saved autocomplete index format."""
+
+
+def get_trie_path(pack_path: str) -> str:
+    """Gets the path the autocomplete index for a pack is saved to, which is next to the pack."""
+    return pack_path + ".autocomplete.json"
+
+
+def read_pack_trie(pack_path: str, stamps: List[SourceStamp]) -> Optional[Trie]:
+    """Reads the saved autocomplete index for a pack, returning None if there is none or the pack (or its journal) changed since it was saved. The stamps come from get_pack_stamps."""
+    try:
+        with open(get_trie_path(pack_path), "r", encoding="utf-8") as file:
+            data: Dict[str, Any] = json.load(file)
+    except (OSError, ValueError):
+        return None
+
+    # JSON turns tuples into lists, so the stamps are compared as lists
+    if data.get("version") != TRIE_CACHE_VERSION or data.get("sources") != [list(stamp) for stamp in stamps]:
+        return None
+
+    try:
+        return Trie.from_data(data["trie"])
+    except (KeyError, TypeError):
+        return None
+
+
+def write_pack_trie(pack_path: str, stamps: List[SourceStamp], trie: Trie):
+    """Saves the autocomplete index for a pack next to it. The stamps should match the pack the Trie was built from, so a pack saved or edited in the meantime invalidates the index."""
+    path = get_trie_path(pack_path)
+
+    try:
+        handle, temp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix=".tmp")
+
+        with os.fdopen(handle, "w", encoding="utf-8") as file:
+            json.dump({"version": TRIE_CACHE_VERSION, "sources": [list(stamp) for stamp in stamps], "trie": trie.to_data()}, file, separators=(",", ":"))
+
+        os.replace(temp_path, path)
+    except OSError as e:
+        # The index is only an optimization, so failing to save it shouldn't stop the GUI
+        print(f"Could not save the autocomplete index: {e}")
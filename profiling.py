@@ -0,0 +1,238 @@
+import bisect
+import contextlib
+import cProfile
+import dataclasses
+import json
+import threading
+import time
+import tracemalloc
+
+
+from dataclasses import dataclass
+from typing import Iterator, List, Optional, Tuple
+
+
+@dataclass
+class EngineCounters:
+    """EngineCounters counts the work done by the cost engine during a run. Counting is opt-in: code that updates the counters only does so when an EngineCounters instance has been attached."""
+    recipe_expansions: int = 0
+    """How many times a recipe was expanded into its inputs."""
+
+    item_stack_allocations: int = 0
+    """How many ItemStacks were created while calculating and sorting the results."""
+
+    depth_dictionary_rebuilds: int = 0
+    """How many times the recursive engine built a new depth dictionary."""
+
+    calculate_costs_levels: int = 0
+    """How many levels of recursion calculate_costs went through (the single-pass engine always counts as 1)."""
+
+    depth_cache_hits: int = 0
+    """How many recipe depth lookups were answered from the pack's depth cache."""
+
+    depth_cache_misses: int = 0
+    """How many recipe depth lookups had to calculate depths."""
+
+    sub_craft_cache_hits: int = 0
+    """How many sub-craft lookups (used by write_html) were answered from the cache."""
+
+    sub_craft_cache_misses: int = 0
+    """How many sub-craft lookups had to be calculated."""
+
+    def to_json(self) -> str:
+        """Returns the counters as a JSON string."""
+        return json.dumps(dataclasses.asdict(self), indent=4)
+
+
+class PhaseTiming:
+    """PhaseTiming stores the measurements for one phase of a profiled run."""
+    def __init__(self, name: str, wall_time: float, peak_memory: int, memory_change: int):
+        self.name = name
+        """Name of the phase."""
+
+        self.wall_time = wall_time
+        """How long the phase took, in seconds."""
+
+        self.peak_memory = peak_memory
+        """Highest amount of memory (in bytes) allocated above what was allocated when the phase started."""
+
+        self.memory_change = memory_change
+        """How much more memory (in bytes) was allocated at the end of the phase than at the start."""
+
+
+class PhaseProfiler:
+    """PhaseProfiler records the wall time and peak memory of each phase of the cost calculator. When it is disabled, phases are not measured at all."""
+    def __init__(self, enabled: bool=False, stats_path: Optional[str]=None, top_allocations: int=0):
+        self.enabled = enabled
+        """Is profiling turned on?"""
+
+        self.stats_path = stats_path
+        """Path to dump cProfile/pstats results to, if any."""
+
+        self.top_allocations = top_allocations
+        """How many of the lines that allocated the most memory should be reported by tracemalloc (0 to skip the report)."""
+
+        self.timings: List[PhaseTiming] = []
+        """Measurements for every phase, in the order they finished."""
+
+        self.profile: Optional[cProfile.Profile] = None
+        """The cProfile profiler, which is only used if stats_path is set."""
+
+        if self.enabled:
+            tracemalloc.start()
+
+            if self.stats_path is not None:
+                self.profile = cProfile.Profile()
+                self.profile.enable()
+
+    @contextlib.contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        """Context manager that measures a phase. Phases should not be nested, since tracemalloc only tracks one peak at a time."""
+        if not self.enabled:
+            yield
+            return
+
+        tracemalloc.reset_peak()
+        start_memory = tracemalloc.get_traced_memory()[0]
+        start_time = time.perf_counter()
+
+        try:
+            yield
+        finally:
+            wall_time = time.perf_counter() - start_time
+            end_memory, peak_memory = tracemalloc.get_traced_memory()
+
+            self.timings.append(PhaseTiming(name, wall_time, peak_memory - start_memory, end_memory - start_memory))
+
+    def finish(self) -> str:
+        """Stops profiling, dumps the pstats file if needed and returns the report to display."""
+        if not self.enabled:
+            return ""
+
+        lines = ["", "Profile:", f"{'phase':24} {'wall time':>12} {'peak memory':>14} {'memory change':>14}"]
+
+        for timing in self.timings:
+            lines.append(f"{timing.name:24} {timing.wall_time * 1000:>9.2f} ms {format_bytes(timing.peak_memory):>14} {format_bytes(timing.memory_change):>14}")
+
+        lines.append(f"{'total':24} {sum([timing.wall_time for timing in self.timings]) * 1000:>9.2f} ms")
+
+        if self.profile is not None and self.stats_path is not None:
+            self.profile.disable()
+            self.profile.dump_stats(self.stats_path)
+
+            lines.append(f"\nSaved cProfile stats to {self.stats_path}")
+
+        if self.top_allocations > 0:
+            lines.append(f"\nTop {self.top_allocations} allocations still held at the end of the run:")
+
+            for stat in tracemalloc.take_snapshot().statistics("lineno")[:self.top_allocations]:
+                lines.append(f"    {stat}")
+
+        tracemalloc.stop()
+
+        return "\n".join(lines)
+
+
+FRAME_BUDGET_MS = 1000 / 60
+"""Time available to render one frame at 60 FPS, in milliseconds. UI work that takes longer than this is visible as a stall."""
+
+LATENCY_BUCKETS_MS = [1.0, 2.0, 4.0, 8.0, FRAME_BUDGET_MS, 33.0, 50.0, 100.0, 250.0]
+"""Upper bounds (in milliseconds) of the buckets used by LatencyHistogram. Anything slower goes into one last bucket."""
+
+
+class LatencyHistogram:
+    """LatencyHistogram counts latencies into fixed buckets. It is safe to record latencies from several threads."""
+    def __init__(self, bounds: List[float]=LATENCY_BUCKETS_MS):
+        self.bounds = bounds
+        """Upper bounds of the buckets, in milliseconds."""
+
+        self.counts = [0] * (len(bounds) + 1)
+        """How many latencies fell into each bucket. The last bucket holds everything above the last bound."""
+
+        self.max_latency = 0.0
+        """Slowest latency recorded, in milliseconds."""
+
+        self.lock = threading.Lock()
+        """Lock protecting the counts."""
+
+    def record(self, seconds: float):
+        """Records a latency, given in seconds."""
+        milliseconds = seconds * 1000
+
+        with self.lock:
+            self.counts[bisect.bisect_left(self.bounds, milliseconds)] += 1
+            self.max_latency = max(self.max_latency, milliseconds)
+
+    def get_total(self) -> int:
+        """Returns how many latencies were recorded."""
+        return sum(self.counts)
+
+    def format(self, budget: float=FRAME_BUDGET_MS) -> str:
+        """Formats the histogram for displaying, along with how many latencies were within the budget (in milliseconds)."""
+        with self.lock:
+            counts = list(self.counts)
+            max_latency = self.max_latency
+
+        total = sum(counts)
+
+        if total == 0:
+            return "No latencies recorded"
+
+        lines: List[str] = []
+        lower = 0.0
+
+        for bound, count in zip(self.bounds + [float("inf")], counts):
+            label = f"{lower:.1f}-{bound:.1f} ms" if bound != float("inf") else f"> {lower:.1f} ms"
+            lines.append(f"{label:>16} {count:>8} {'#' * round(count / total * 40)}")
+            lower = bound
+
+        within_budget = sum([count for bound, count in zip(self.bounds, counts) if bound <= budget])
+
+        lines.append(f"{within_budget / total * 100:.1f}% of {total} within {budget:.1f} ms, slowest {max_latency:.2f} ms")
+
+        return "\n".join(lines)
+
+
+def format_bytes(amount: int) -> str:
+    """Formats an amount of bytes as a human readable string."""
+    size = float(amount)
+
+    for unit in ["B", "KiB", "MiB"]:
+        if abs(size) < 1024:
+            return f"{size:.1f} {unit}"
+
+        size /= 1024
+
+    return f"{size:.1f} GiB"
+
+
+def parse_profile_args(args: List[str]) -> Tuple[List[str], PhaseProfiler]:
+    """Removes the profiling options from a list of command line arguments, returning the remaining arguments and a PhaseProfiler set up from the options.
+
+    --profile turns on profiling, --profile-stats PATH also dumps a cProfile/pstats file and --profile-top N also prints the top N tracemalloc allocations."""
+    remaining: List[str] = []
+    enabled = False
+    stats_path: Optional[str] = None
+    top_allocations = 0
+
+    index = 0
+
+    while index < len(args):
+        arg = args[index]
+
+        if arg == "--profile":
+            enabled = True
+        elif arg == "--profile-stats" and index + 1 < len(args):
+            enabled = True
+            stats_path = args[index + 1]
+            index += 1
+        elif arg == "--profile-top" and index + 1 < len(args):
+            enabled = True
+            top_allocations = int(args[index + 1])
+            index += 1
+        else:
+            remaining.append(arg)
+
+        index += 1
+
+    return remaining, PhaseProfiler(enabled, stats_path, top_allocations)
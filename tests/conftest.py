@@ -0,0 +1,12 @@
+import os
+import sys
+
+
+# The tests live in their own directory, so the main modules have to be added to the path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def write_pack(path: str, text: str="furnace:\n    items:\n        - 8 cobblestone\n\n"):
+    """Writes a pack file for a test. By default it is a small pack to start from."""
+    with open(path, "w") as f:
+        f.write(text)
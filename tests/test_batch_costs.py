@@ -0,0 +1,32 @@
+import pytest
+from utils import *
+from compiled_pack import compile_pack
+
+# batch_costs is the only part of the calculator that needs numpy
+pytest.importorskip("numpy")
+from batch_costs import evaluate_order_list
+
+
+def test_items_outside_the_pack_are_raw_materials():
+    pack = PackConfigFile(None)
+    pack.set_recipe("plate", CraftingRecipe("plate", [ItemStack("ingot", 2)]))
+
+    result = evaluate_order_list(compile_pack(pack), [{"plate": 3, "ore": 5}, {"ingot": 1, "ore": 2}])
+
+    assert result.get_raw_materials(0) == {"ingot": 6, "ore": 5}
+    assert result.get_raw_materials(1) == {"ingot": 1, "ore": 2}
+
+
+def test_sums_that_wrap_around_int64_fall_back_to_python_integers():
+    pack = PackConfigFile(None)
+    names = ["a", "b", "c", "d", "e", "f", "g", "h"]
+
+    # Eight edges of 2^62 land on x, which wraps all the way around to 0 in an int64
+    for name in names:
+        pack.set_recipe(name, CraftingRecipe(name, [ItemStack("x", 2 ** 62)]))
+
+    pack.set_recipe("top", CraftingRecipe("top", [ItemStack(name) for name in names]))
+
+    result = evaluate_order_list(compile_pack(pack), [{"top": 1}])
+
+    assert result.get_raw_materials(0) == {"x": 8 * 2 ** 62}
@@ -0,0 +1,52 @@
+import random
+from utils import *
+from compiled_pack import compile_pack, open_compiled_pack, write_compiled_pack
+
+
+def make_pack() -> PackConfigFile:
+    """Makes a pack with names that share prefixes, names outside ASCII and a recipe loop, which are the awkward cases for the string table and the name index."""
+    rng = random.Random(14)
+    names = ["iron", "iron plate", "iron plate 2", "iron_rod", "ironwood", "stone", "ölfass", "木材", "copper", "c", "a b c"]
+    pack = PackConfigFile(None)
+
+    for index, name in enumerate(names[:8]):
+        inputs = [ItemStack(other, rng.randint(1, 16)) for other in rng.sample(names[index + 1:], min(2, len(names) - index - 1))]
+        pack.set_recipe(name, CraftingRecipe(name, inputs, rng.choice([1, 3])))
+
+    pack.set_recipe("loop one", CraftingRecipe("loop one", [ItemStack("loop two")]))
+    pack.set_recipe("loop two", CraftingRecipe("loop two", [ItemStack("loop one"), ItemStack("stone")]))
+    pack.compute_depths()
+
+    return pack
+
+
+def test_compiled_pack_round_trips_through_file(tmp_path):
+    path = str(tmp_path / "pack.cpack")
+    compiled = compile_pack(make_pack())
+
+    write_compiled_pack(compiled, path)
+    opened = open_compiled_pack(path)
+
+    assert list(opened.names) == list(compiled.names)
+    assert opened.names[1:3] == list(compiled.names[1:3])
+    assert opened.craftable_count == compiled.craftable_count
+    assert opened.loop_items == compiled.loop_items
+
+    for attribute in ["offsets", "input_ids", "input_amounts", "produces", "depths"]:
+        assert list(getattr(opened, attribute)) == list(getattr(compiled, attribute)), attribute
+
+    for item_id, name in enumerate(compiled.names):
+        assert opened.get_id(name) == item_id
+        assert opened.has_recipe(name) == compiled.has_recipe(name)
+        assert opened.simplified_calculate_cost(name, 37) == compiled.simplified_calculate_cost(name, 37)
+        assert opened.get_all_raw_materials(name) == compiled.get_all_raw_materials(name)
+
+
+def test_names_missing_from_compiled_file_are_not_found(tmp_path):
+    path = str(tmp_path / "pack.cpack")
+    write_compiled_pack(compile_pack(make_pack()), path)
+    opened = open_compiled_pack(path)
+
+    for name in ["", "iro", "iron plate 3", "ironwoods", "zzz", "木", "ölfass "]:
+        assert opened.get_id(name) == -1
+        assert not opened.has_recipe(name)
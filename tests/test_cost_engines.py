@@ -0,0 +1,81 @@
+import random
+import pytest
+from utils import *
+import calchelper
+import calculator
+
+
+CONFIG = """current pack: pack.yaml
+addons: []
+print items without recipes: true
+display all raw materials: true
+html output: false
+show left over amount: false
+use alternate sorting depth method: {alt}
+show crafting bytes: true
+use topological cost engine: {topological}
+use pack cache: false
+"""
+
+
+def make_random_pack(rng: random.Random, size: int) -> PackConfigFile:
+    """Makes a pack without loops. Recipes only use items with a higher number, and the numbers past size have no recipe, so they are raw materials."""
+    pack = PackConfigFile(None)
+
+    for index in range(size):
+        inputs = [ItemStack(f"item{other}", rng.randint(1, 9)) for other in rng.sample(range(index + 1, size + 5), rng.randint(1, 4))]
+        pack.set_recipe(f"item{index}", CraftingRecipe(f"item{index}", inputs, rng.choice([1, 1, 2, 3, 8])))
+
+    pack.add_ae2_fluid(f"item{size + 1}")
+
+    return pack
+
+
+def run_engine(pack: PackConfigFile, items: Dict[str, int], topological: bool, alt: bool) -> Tuple[Any, ...]:
+    """Calculates the costs of the items with one of the engines, returning everything the calculator shows from them."""
+    calchelper.save_data("pack.yaml", pack, force=True)
+
+    with open("app-config.yaml", "w") as f:
+        f.write(CONFIG.format(alt=str(alt).lower(), topological=str(topological).lower()))
+
+    app = calculator.App([], clear_screen=False)
+    app.load_recipes()
+    results = app.get_results(dict(items))
+
+    return ({depth: [repr(stack) for stack in stacks] for depth, stacks in results.items()}, app.crafting_bytes, app.alt_sorting_depth)
+
+
+@pytest.mark.parametrize("seed", range(8))
+def test_topological_engine_matches_recursive_engine(tmp_path, monkeypatch, seed):
+    monkeypatch.chdir(tmp_path)
+    rng = random.Random(seed)
+    size = rng.randint(5, 40)
+    pack = make_random_pack(rng, size)
+
+    # Orders mix craftable items, raw materials and items the pack doesn't know about
+    items = {f"item{index}": rng.randint(1, 100) for index in rng.sample(range(size + 3), 3)}
+    items["unknown"] = 2
+
+    for alt in (False, True):
+        assert run_engine(pack, items, True, alt) == run_engine(pack, items, False, alt)
+
+
+def test_engines_agree_around_recipe_loops(tmp_path, monkeypatch, capsys):
+    monkeypatch.chdir(tmp_path)
+    pack = make_random_pack(random.Random(1), 10)
+
+    # item0 uses a loop through item1, and loop_user only uses the loop, while item5 and below are untouched
+    pack.set_recipe("item0", CraftingRecipe("item0", [ItemStack("item1"), ItemStack("item2", 5)]))
+    pack.set_recipe("item1", CraftingRecipe("item1", [ItemStack("loop_a", 2)]))
+    pack.set_recipe("loop_a", CraftingRecipe("loop_a", [ItemStack("loop_b")]))
+    pack.set_recipe("loop_b", CraftingRecipe("loop_b", [ItemStack("loop_a"), ItemStack("item5")]))
+    pack.set_recipe("loop_user", CraftingRecipe("loop_user", [ItemStack("loop_b", 3)]))
+
+    items = {"item0": 4, "loop_user": 1, "item5": 7, "item9": 2}
+    topological = run_engine(pack, items, True, False)
+    output = capsys.readouterr().out
+
+    assert topological == run_engine(pack, items, False, False)
+    assert "Can't calculate the cost of item0" in output
+    assert "Can't calculate the cost of loop_user" in output
+    assert topological[0][0] == ["7 item5", "2 item9"]
@@ -0,0 +1,63 @@
+import random
+import pytest
+from utils import *
+
+
+def make_pack(recipes: List[Tuple[str, str]]) -> PackConfigFile:
+    """Makes a pack where each recipe crafts an item from 1 of another item."""
+    pack = PackConfigFile(None)
+
+    for output, item in recipes:
+        pack.set_recipe(output, CraftingRecipe(output, [ItemStack(item)]))
+
+    return pack
+
+
+def test_separate_loops_are_reported_separately():
+    pack = make_pack([("a", "b"), ("b", "a"), ("c", "d"), ("d", "c"), ("e", "a"), ("f", "raw")])
+
+    assert sorted(pack.compute_depths()) == [["a", "b"], ["c", "d"]]
+    assert pack.loop_errors["d"] == ["c", "d"]
+    assert pack.loop_errors["e"] == ["a", "b"]
+    assert pack.depths == {"f": 1}
+
+    with pytest.raises(RecipeLoopError) as error:
+        pack.get_recipe_depth("c")
+
+    assert error.value.items == ["c", "d"]
+
+
+def test_earlier_loop_is_reported_for_new_users():
+    pack = make_pack([("a", "b"), ("b", "a")])
+    pack.compute_depths()
+
+    pack.set_recipe("g", CraftingRecipe("g", [ItemStack("a")]))
+
+    assert pack.compute_depths(["g"]) == []
+    assert pack.loop_errors["g"] == ["a", "b"]
+
+
+def test_loops_stay_right_after_random_edits():
+    rng = random.Random(6)
+    names = [f"item{i}" for i in range(30)]
+    pack = PackConfigFile(None)
+
+    for step in range(300):
+        item = rng.choice(names)
+
+        if pack.has_recipe(item) and rng.random() < 0.3:
+            pack.delete_recipe(item)
+        else:
+            pack.set_recipe(item, CraftingRecipe(item, [ItemStack(name) for name in rng.sample(names, rng.randint(1, 2))]))
+
+        # Check every few edits, so some edits land on top of each other before the cache is used
+        if step % 5 == 0:
+            fresh = make_pack([])
+
+            for name, recipe in pack.get_recipes_iterable():
+                fresh.set_recipe(name, CraftingRecipe(name, list(recipe.inputs)))
+
+            assert pack.find_recipe_loops() == sorted(fresh.find_loops_in(fresh.recipes))
+
+            for name in names:
+                assert (pack.get_recipe_loop(name) is None) == (fresh.get_recipe_loop(name) is None)
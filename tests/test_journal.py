@@ -0,0 +1,65 @@
+from utils import *
+import calchelper
+from conftest import write_pack
+
+
+def test_torn_entry_does_not_hide_later_edits(tmp_path):
+    path = str(tmp_path / "pack.yaml")
+    write_pack(path)
+
+    journal = calchelper.PackJournal(path)
+    journal.set_recipe(CraftingRecipe("chest", [ItemStack("planks", 8)]))
+    journal.file.close()
+
+    # The program stopped halfway through writing an entry
+    with open(get_journal_path(path), "a", encoding="utf-8") as f:
+        f.write('{"op": "set", "item": "bro')
+
+    journal = calchelper.PackJournal(path)
+    journal.set_recipe(CraftingRecipe("hopper", [ItemStack("chest"), ItemStack("iron", 5)]))
+    journal.add_raw_material("iron")
+    journal.file.close()
+
+    pack = load_pack_config(path)
+
+    assert [item for item, _ in pack.get_recipes_iterable()] == ["furnace", "chest", "hopper"]
+    assert list(pack.get_raw_materials()) == ["iron"]
+
+
+def test_broken_entry_is_skipped(tmp_path, capsys):
+    path = str(tmp_path / "pack.yaml")
+    write_pack(path)
+
+    with open(get_journal_path(path), "w", encoding="utf-8") as f:
+        f.write('{"op": "set", "item": "bro\n')
+        f.write('{"op": "delete", "item": "furnace"}\n')
+
+    pack = load_pack_config(path)
+
+    assert not pack.has_recipe("furnace")
+    assert "line 1" in capsys.readouterr().out
+
+
+def test_repair_journal_only_cuts_unfinished_entry(tmp_path):
+    journal_path = str(tmp_path / "pack.yaml.journal")
+
+    with open(journal_path, "w", encoding="utf-8") as f:
+        f.write('{"op": "add_fluid", "item": "water"}\n{"op": "add_fl')
+
+    assert repair_journal(journal_path) == len('{"op": "add_fl')
+    assert repair_journal(journal_path) == 0
+
+    with open(journal_path, "r", encoding="utf-8") as f:
+        assert f.read() == '{"op": "add_fluid", "item": "water"}\n'
+
+
+def test_resave_keeps_materials_and_fluids_in_place(tmp_path):
+    path = str(tmp_path / "pack.yaml")
+    text = "ae2_fluids:\n    items:\n        - 1 water\n\nplate:\n    items:\n        - 2 ingot\n\nmaterials:\n    items:\n        - 1 ore\n\nglass:\n    produces: 4\n\n    items:\n        - 1 sand\n\n"
+
+    write_pack(path, text)
+
+    assert calchelper.save_data(path, load_pack_config(path), force=True)
+
+    with open(path, "r") as f:
+        assert f.read() == text
@@ -0,0 +1,32 @@
+from utils import *
+from pack_cache import PackLayers
+from conftest import write_pack
+
+
+def describe(pack: PackConfigFile) -> Tuple[Any, ...]:
+    """Everything about a pack that layering should keep the same as extend_pack."""
+    pack.compute_depths()
+
+    return ([repr(recipe) for _, recipe in pack.get_recipes_iterable()], dict(pack.depths), {item: sorted(consumers) for item, consumers in pack.consumers.items() if len(consumers) > 0}, list(pack.get_raw_materials()))
+
+
+def test_layers_match_extend_pack_and_leave_base_alone(tmp_path):
+    base_path = str(tmp_path / "base.yaml")
+    addon_path = str(tmp_path / "addon.yaml")
+
+    write_pack(base_path, "plate:\n    items:\n        - 2 ingot\n\ngear:\n    items:\n        - 4 plate\n\nmaterials:\n    items:\n        - 1 ingot\n\n")
+    write_pack(addon_path, "ingot:\n    items:\n        - 1 ore\n\nplate:\n    produces: 2\n\n    items:\n        - 3 ingot\n\n")
+
+    layers = PackLayers(base_path)
+    base = layers.get_layer(base_path)
+    base_before = describe(base)
+
+    expected = load_pack_config(base_path)
+    expected.extend_pack(load_pack_config(addon_path))
+
+    layered = layers.resolve([addon_path])
+
+    assert describe(layered) == describe(expected)
+    assert describe(base) == base_before
+    assert layers.resolve([addon_path]) is layered
+    assert describe(layers.resolve([])) == base_before
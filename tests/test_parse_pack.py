@@ -0,0 +1,89 @@
+import random
+import pytest
+from utils import *
+import calchelper
+from conftest import write_pack
+
+
+def describe(pack: PackConfigFile) -> Tuple[Any, ...]:
+    """Everything about a pack that comes from its file."""
+    return ([(item, recipe.amount_produced, [(stack.name, stack.amount) for stack in recipe.inputs]) for item, recipe in pack.get_recipes_iterable()], list(pack.get_raw_materials()), list(pack.get_ae2_fluids()))
+
+
+def load_with_yaml(path: str) -> PackConfigFile:
+    return PackConfigFile(load_config_file(path))
+
+
+def test_saved_packs_parse_the_same_as_yaml(tmp_path):
+    path = str(tmp_path / "pack.yaml")
+    rng = random.Random(24)
+    pack = PackConfigFile(None)
+
+    for index in range(50):
+        inputs = [ItemStack(f"part {rng.randint(0, 80)}", rng.randint(1, 64)) for _ in range(rng.randint(1, 5))]
+        pack.set_recipe(f"item {index}", CraftingRecipe(f"item {index}", inputs, rng.choice([1, 2, 4])))
+
+    pack.add_raw_material("part 3")
+    pack.add_ae2_fluid("water")
+    calchelper.save_data(path, pack, force=True)
+
+    parsed = parse_pack_file(path)
+
+    assert parsed is not None
+    assert describe(parsed) == describe(load_with_yaml(path)) == describe(pack)
+
+
+@pytest.mark.parametrize("text", [
+    "# comment\nplate:\n    items:\n        - 2 ingot\n\n",
+    "plate:\n    items:\n        - 2 ingot # comment\n\n",
+    "plate:\n    items: [2 ingot, gear]\n\n",
+    "'plate':\n    items:\n        - 2 ingot\n\n",
+    "plate:\n    items:\n        - \"2 ingot\"\n\n",
+    "plate:\n  items:\n    - 2 ingot\n\n",
+    "plate:\n    items:\n        - 2 ingot\n\nplate:\n    items:\n        - 3 ingot\n\n",
+    "plate:\n    items:\n        - true\n\n",
+    "plate:\n    items:\n        - 12\n\n",
+    "yes:\n    items:\n        - 2 ingot\n\n",
+    "plate:\n    items:\n    produces: 2\n        - 2 ingot\n\n",
+])
+def test_other_layouts_fall_back_to_yaml(tmp_path, text):
+    path = str(tmp_path / "pack.yaml")
+    write_pack(path, text)
+
+    assert parse_pack_file(path) is None
+
+    # load_pack_file gives whatever the YAML loader makes of the file, or fails the same way
+    try:
+        expected = describe(load_with_yaml(path))
+    except Exception as error:
+        with pytest.raises(type(error)):
+            load_pack_file(path)
+    else:
+        assert describe(load_pack_file(path)) == expected
+
+
+def test_parsed_or_fallen_back_packs_match_yaml(tmp_path):
+    path = str(tmp_path / "pack.yaml")
+    rng = random.Random(7)
+    values = ["stone", "3 stone", "2 raw 4", "a: b", "a #b", "'q'", "- x", " x", "null", "1.5", "on", "&a", "a-b", "é stuff", "0x1f", "materials", "ae2_fluids"]
+
+    for _ in range(300):
+        lines: List[str] = []
+
+        for index in range(rng.randint(0, 4)):
+            lines.append(f"{rng.choice(values + [f'key {index}'])}:")
+
+            if rng.random() < 0.3:
+                lines.append(f"    produces: {rng.choice(['2', '012', '0', 'x'])}")
+
+            lines.append("    items:")
+            lines.extend([f"        - {rng.choice(values)}" for _ in range(rng.randint(0, 3))])
+            lines.append("")
+
+        write_pack(path, "\n".join(lines) + "\n")
+
+        parsed = parse_pack_file(path)
+
+        # The YAML loader is the reference, the fast parser only has to agree when it doesn't give up
+        if parsed is not None:
+            assert describe(parsed) == describe(load_with_yaml(path))
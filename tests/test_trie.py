@@ -0,0 +1,108 @@
+import random
+from utils import *
+
+
+class OldTrie:
+    """The recursive Trie that the array-backed Trie replaced, kept as a reference. It walks down the most common next character until a word makes up the majority of what is left. Its dictionary belongs to the instance here instead of the class."""
+    def __init__(self, dictionary: Optional[Set[str]]=None):
+        self.characters: Dict[str, Tuple[int, Optional["OldTrie"]]] = {}
+        self.dictionary: Set[str] = set() if dictionary is None else dictionary
+        self.total_words = 0
+
+    def add_word(self, word: str, multiplier: int=1):
+        self.dictionary.add(word)
+        self.total_words += multiplier
+
+        amount, next_trie = self.characters.get(word[0], (0, None))
+
+        if len(word) > 1:
+            next_trie = OldTrie(self.dictionary) if next_trie is None else next_trie
+            next_trie.add_word(word[1:], multiplier)
+
+        self.characters[word[0]] = (amount + multiplier, next_trie)
+
+    def predict_word(self, word: str, num_words: int=-1, current: str="", start: Optional[str]=None) -> str:
+        num_words = num_words if num_words >= 0 else self.total_words
+        start = word if start is None else start
+
+        if len(word) == 0:
+            max_char, (max_amount, next_trie) = max(self.characters.items(), key=lambda entry: entry[1][0])
+
+            if current in self.dictionary and max_amount <= num_words - max_amount:
+                # Typing a whole word carries on to a longer word, any other word that holds the majority ends the prediction
+                if current == start and next_trie is not None:
+                    return max_char + next_trie.predict_word(word, max_amount, current + max_char, start)
+                else:
+                    return ""
+            elif next_trie is None:
+                return max_char
+            else:
+                return max_char + next_trie.predict_word(word, max_amount, current + max_char, start)
+
+        if word[0] not in self.characters:
+            return ""
+
+        amount, next_trie = self.characters[word[0]]
+
+        if next_trie is None:
+            return word[0]
+
+        rest = next_trie.predict_word(word[1:], amount, current + word[0], start)
+
+        return "" if rest == "" else word[0] + rest
+
+
+def test_prediction_matches_old_trie_when_one_word_leads():
+    rng = random.Random(19)
+
+    for _ in range(200):
+        old = OldTrie()
+        trie = Trie()
+        words = {"".join(rng.choice("abc") for _ in range(rng.randint(1, 6))): rng.randint(1, 3) for _ in range(rng.randint(1, 12))}
+
+        for word, count in words.items():
+            old.add_word(word, count)
+            trie.add_word(word, count)
+
+        # Once a word was added more times than all the others together, both Tries rank it first for every prefix of it
+        leader = rng.choice(list(words))
+        old.add_word(leader, sum(words.values()))
+        trie.add_word(leader, sum(words.values()))
+
+        for end in range(len(leader)):
+            assert trie.predict_word(leader[:end]) == old.predict_word(leader[:end]) == leader
+
+        assert trie.predict_word("z") == old.predict_word("z") == ""
+
+
+def test_gui_keywords_win_over_pack_words():
+    trie = Trie()
+
+    for word in ["cheese", "chest", "chest", "delay", "raw", "ae2"]:
+        trie.add_word(word)
+
+    for word in ["ae2_fluid", "raw_material", "check", "delete"]:
+        trie.add_word(word, 1000)
+
+    assert trie.predict_word("ch") == "check"
+    assert trie.predict_word("ches") == "chest"
+    assert trie.predict_word("de") == "delete"
+    assert trie.predict_word("del") == "delete"
+    assert trie.predict_word("dela") == "delay"
+    assert trie.predict_word("r") == "raw_material"
+    assert trie.predict_word("x") == ""
+
+
+def test_ties_go_to_shorter_then_alphabetical_words():
+    trie = Trie()
+
+    for word in ["planks", "plank", "plate", "plant"]:
+        trie.add_word(word)
+
+    assert trie.predict_word("pl") == "plank"
+    assert trie.predict_word("plat") == "plate"
+
+    trie.add_word("plate")
+
+    assert trie.predict_word("pl") == "plate"
+    assert Trie.from_data(trie.to_data()).predict_word("pla") == "plate"
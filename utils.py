@@ -1,13 +1,17 @@
-import collections, math, os, platform, sys, yaml
+import collections, json, math, os, platform, sys, yaml
 import re
-from dataclasses import dataclass
-from typing import Any, Dict, Iterator, List, Optional, Set, Tuple
+from typing import Any, Collection, Dict, Iterable, Iterator, KeysView, List, Optional, Set, Tuple
+from profiling import EngineCounters
 
 
 YAML_Data = Dict[str, Any]
 """Type that represents a YAML file. Since we do not know more about the typing, it has a general type."""
 
 
+YAML_Loader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+"""Loader used for config files. The libyaml C loader is much faster on big packs, but PyYAML can be installed without it, so it falls back to the pure Python loader."""
+
+
 clear_command = "cls" if platform.system() == "Windows" else "clear"
 """What command to call to clear the screen. cls is for Windows, clear is for Unix."""
 
@@ -40,7 +44,12 @@ def load_config_file(path: str, create: bool=False) -> YAML_Data:
             sys.exit()
 
     with open(path, "r+") as file:
-        return yaml.safe_load(file)
+        return yaml.load(file, Loader=YAML_Loader)
+
+
+def ceil_divide(numerator: int, denominator: int) -> int:
+    """Divides 2 integers, rounding up. Unlike math.ceil(a / b), this stays exact for numbers too large to fit in a float."""
+    return -(-numerator // denominator)
 
 
 def to_exponent_string(num: int) -> str:
@@ -89,6 +98,13 @@ class MainConfigFile:
         
         self.show_crafting_bytes: bool = yaml_file["show crafting bytes"]
         """Should the cost calculator display how many bytes AE2 would need to calculate the craft? (Assume that for fluids, 1000 mb of the fluid is treated as one item, this can also apply to life essence, demon will, essentia, or other things)"""
+
+        # Older config files don't have this option, so it defaults to the new engine
+        self.use_topological_engine: bool = yaml_file.get("use topological cost engine", True)
+        """Should the cost calculator use the single-pass topological engine? If false, it uses the original recursive engine."""
+
+        self.use_pack_cache: bool = yaml_file.get("use pack cache", True)
+        """Should the cost calculator cache the parsed pack and addons on disk, so later runs can skip parsing them if they haven't changed?"""
         
 
 def load_main_config() -> MainConfigFile:
@@ -96,6 +112,22 @@ def load_main_config() -> MainConfigFile:
     return MainConfigFile(load_config_file("app-config.yaml"))
 
 
+class RecipeLoopError(Exception):
+    """RecipeLoopError is raised when a recipe loop is detected."""
+    def __init__(self, name: str, items: Optional[List[str]]=None):
+        self.name = name
+        """Name of the item which caused the error."""
+
+        self.items: List[str] = [name] if items is None else items
+        """Items that are part of the recipe loop."""
+
+        super().__init__(f"RecipeLoopError with item {name}" if items is None else f"RecipeLoopError with item {name} (recipe loop: {', '.join(self.items)})")
+
+
+SPECIAL_ITEM_LISTS = ("materials", "ae2_fluids")
+"""Keys in pack files that hold lists of raw materials and AE2 fluids instead of recipes."""
+
+
 class PackConfigFile:
     """Class representing a recipe pack configuration file."""
     # Pass the yaml file from load_config_file
@@ -104,16 +136,80 @@ class PackConfigFile:
         self.recipes: Dict[str, CraftingRecipe] = {}
         """This dict maps the names of items to a CraftingRecipe for that item."""
 
+        self.consumers: Dict[str, Set[str]] = collections.defaultdict(set)
+        """Maps the name of an item to the names of the items whose recipes use it. Kept up to date by set_recipe and delete_recipe."""
+
+        self.borrowed_consumers: Set[str] = set()
+        """Items whose set in consumers still belongs to the pack this one was layered from (see with_addons). Those sets are copied before they are changed."""
+
+        self.depths: Dict[str, int] = {}
+        """Cache of the depth of each recipe. Entries are invalidated when a recipe they depend on changes."""
+
+        self.loop_errors: Dict[str, List[str]] = {}
+        """Cache of the items that can't be given a depth because of a recipe loop, mapped to the items that make up the loop."""
+
+        self.counters: Optional[EngineCounters] = None
+        """Counters for depth cache hits and misses, which are only updated if counters have been attached."""
+
+        self.item_ids: Dict[str, int] = {}
+        """Interned ids of item names, used as bit positions in raw_material_closures. Ids are handed out as items are seen and never reused."""
+
+        self.item_names: List[str] = []
+        """Maps the ids in item_ids back to item names."""
+
+        self.raw_material_closures: Dict[str, int] = {}
+        """Cache of the raw materials (items without recipes) used by each recipe, directly or indirectly, as a bitset over item_ids. Entries are invalidated along with the depths."""
+
+        self.dirty_items: Set[str] = set()
+        """Top-level keys of the pack file (recipe outputs, "materials" and "ae2_fluids") that changed since the pack was last loaded or saved."""
+
+        self.saved_path: Optional[str] = None
+        """Absolute path of the file the pack was last loaded from or saved to, which matches the pack unless something is dirty."""
+
+        self.shared_inputs: Dict[RecipeInputsKey, RecipeInputs] = {}
+        """Flyweight cache of the inputs of the pack's recipes. Recipes with the same inputs share one tuple of ItemStacks, which saves memory on packs with many similar recipes. The cache belongs to the pack, so it goes away with it."""
+
+        self.shared_input_users: Dict[RecipeInputsKey, int] = {}
+        """How many recipes in the pack use each entry of shared_inputs. Entries are dropped once no recipe uses them."""
+
+        self.raw_materials: Dict[str, None] = {}
+        """Ordered set of the raw materials in the pack, stored in the pack file as the "materials" entry. A dict is used so the materials keep the order they were added in."""
+
+        self.ae2_fluids: Dict[str, None] = {}
+        """Ordered set of the AE2 fluids in the pack, stored in the pack file as the "ae2_fluids" entry."""
+
+        self.special_list_positions: Dict[str, int] = {}
+        """How many recipes came before each of the SPECIAL_ITEM_LISTS in the file the pack was loaded from, in the order the lists appeared, so saving can put them back where they were."""
+
         if yaml_file is not None:
             for key, value in yaml_file.items():
-                if len(value["items"]) > 0: # can't have recipe with no inputs
-                    # "produces" does not appear in every yaml item, so just default it to 1.
-                    # We also need to make an item stack for everything in the yaml key "items"
-                    self.recipes[key] = CraftingRecipe(key, [make_item_stack(item) for item in value["items"]], 1 if "produces" not in value else value["produces"])
+                # "produces" does not appear in every yaml item, so just default it to 1.
+                self.add_entry(key, value["items"], 1 if "produces" not in value else value["produces"])
+
+    def add_entry(self, key: str, items: List[str], produces: int=1):
+        """Adds an entry of the pack file (a recipe, or the raw materials or fluids) to the pack, with the items as they are written in the file."""
+        # Raw materials and fluids are stored like recipes in the file, but they are only lists of items
+        if key in SPECIAL_ITEM_LISTS:
+            item_list = self.get_special_item_list(key)
+            self.special_list_positions[key] = len(self.recipes)
+
+            for item in items:
+                item_list[make_item_stack(item).name] = None
+        elif len(items) > 0: # can't have recipe with no inputs
+            # We also need to make an item stack for everything in the yaml key "items"
+            self.set_recipe(key, CraftingRecipe(key, [make_item_stack(item) for item in items], produces))
 
     def delete_recipe(self, item: str):
         """Deletes the recipe outputting the given item from the pack."""
+        self.invalidate_depths(item)
+
+        for stack in self.recipes[item].inputs:
+            self.get_own_consumers(stack.name).discard(item)
+
+        self.release_recipe_inputs(self.recipes[item])
+
         del self.recipes[item]
+        self.dirty_items.add(item)
         
     def has_recipe(self, item: str) -> bool:
         """Returns if the pack has a recipe for the item with the given name."""
@@ -128,7 +224,177 @@ class PackConfigFile:
 
     def set_recipe(self, item: str, recipe: "CraftingRecipe"):
         """Sets a recipe in the pack config for the given item."""
+        if item in self.recipes:
+            self.delete_recipe(item)
+        else:
+            # Items that used this item as a raw material now have a deeper recipe
+            self.invalidate_depths(item)
+
+        self.share_recipe_inputs(recipe)
+
         self.recipes[item] = recipe
+        self.dirty_items.add(item)
+
+        for stack in recipe.inputs:
+            self.get_own_consumers(stack.name).add(item)
+
+    def get_own_consumers(self, item: str) -> Set[str]:
+        """Gets the set of consumers of an item so it can be changed, copying it first if it is borrowed from another pack."""
+        if item in self.borrowed_consumers:
+            self.borrowed_consumers.discard(item)
+            self.consumers[item] = set(self.consumers[item])
+
+        return self.consumers[item]
+
+    def share_recipe_inputs(self, recipe: "CraftingRecipe"):
+        """Makes a recipe use the pack's shared tuple for its inputs, if another recipe in the pack already has the same inputs."""
+        key = get_recipe_inputs_key(recipe.inputs)
+        recipe.inputs = self.shared_inputs.setdefault(key, recipe.inputs)
+        self.shared_input_users[key] = self.shared_input_users.get(key, 0) + 1
+
+    def release_recipe_inputs(self, recipe: "CraftingRecipe"):
+        """Stops counting a recipe that is being removed from the pack as a user of its inputs."""
+        key = get_recipe_inputs_key(recipe.inputs)
+        users = self.shared_input_users.get(key, 0) - 1
+
+        if users > 0:
+            self.shared_input_users[key] = users
+        else:
+            self.shared_input_users.pop(key, None)
+            self.shared_inputs.pop(key, None)
+
+    def is_dirty(self, path: str) -> bool:
+        """Returns if saving the pack to the given path would change the file, because something changed since it was last loaded or saved there (or the file is gone)."""
+        return len(self.dirty_items) > 0 or self.saved_path != os.path.abspath(path) or not os.path.exists(path)
+
+    def mark_saved(self, path: str):
+        """Marks the pack as matching the file at the given path."""
+        self.dirty_items.clear()
+        self.saved_path = os.path.abspath(path)
+
+    def get_used_by(self, item: str) -> Set[str]:
+        """Returns the names of the items whose recipes use the given item directly."""
+        return set(self.consumers.get(item, ()))
+
+    def get_all_used_by(self, item: str) -> Set[str]:
+        """Returns the names of the items whose recipes use the given item, directly or through other recipes. Only the items that use it are visited, so this doesn't scan the whole pack."""
+        result: Set[str] = set()
+        stack = [item]
+
+        while len(stack) > 0:
+            current = stack.pop()
+
+            for consumer in self.consumers.get(current, ()):
+                if consumer not in result:
+                    result.add(consumer)
+                    stack.append(consumer)
+
+        # The item can only show up here if it is part of a recipe loop
+        result.discard(item)
+
+        return result
+
+    def invalidate_depths(self, item: str):
+        """Removes the cached depths and raw material closures of an item and every item that uses it, directly or indirectly."""
+        stack = [item]
+        seen = {item}
+
+        while len(stack) > 0:
+            current = stack.pop()
+
+            was_cached = current in self.depths or current in self.loop_errors or current in self.raw_material_closures
+
+            self.depths.pop(current, None)
+            self.loop_errors.pop(current, None)
+            self.raw_material_closures.pop(current, None)
+
+            # Depths and closures are only ever cached for an item once they are cached for everything it uses, so if nothing was cached here, nothing above it is cached either
+            if not was_cached and current != item:
+                continue
+
+            for consumer in self.consumers.get(current, ()):
+                if consumer not in seen:
+                    seen.add(consumer)
+                    stack.append(consumer)
+
+    def compute_depths(self, items: Optional[List[str]]=None) -> List[List[str]]:
+        """Calculates the depths of the recipes for the given items (or every recipe) and anything they depend on that isn't cached yet, using an iterative topological sort. Returns a list of the recipe loops that were found, which are also cached in loop_errors."""
+        # Start by finding the part of the recipe graph that still needs depths
+        stack = [item for item in (self.recipes.keys() if items is None else items) if item in self.recipes and item not in self.depths and item not in self.loop_errors]
+        pending: Set[str] = set(stack)
+
+        while len(stack) > 0:
+            current = stack.pop()
+
+            for input_stack in self.recipes[current].inputs:
+                name = input_stack.name
+
+                if name in self.recipes and name not in pending and name not in self.depths and name not in self.loop_errors:
+                    pending.add(name)
+                    stack.append(name)
+
+        # Kahn's algorithm: count how many inputs of each recipe are still waiting for a depth. Inputs that are stuck behind a loop count as well, so those recipes never become ready.
+        remaining_inputs: Dict[str, int] = {}
+        ready: List[str] = []
+
+        for name in pending:
+            remaining_inputs[name] = len([stack for stack in self.recipes[name].inputs if stack.name in pending or stack.name in self.loop_errors])
+
+            if remaining_inputs[name] == 0:
+                ready.append(name)
+
+        while len(ready) > 0:
+            name = ready.pop()
+            pending.discard(name)
+
+            # The depth is 1 more than the deepest input (inputs without recipes count as 0)
+            depth = 1 + max([self.depths.get(stack.name, 0) for stack in self.recipes[name].inputs], default=0)
+
+            self.depths[name] = depth
+            self.recipes[name].depth = depth
+
+            for consumer in self.consumers.get(name, ()):
+                if consumer in remaining_inputs and consumer in pending:
+                    remaining_inputs[consumer] -= 1
+
+                    if remaining_inputs[consumer] == 0:
+                        ready.append(consumer)
+
+        if len(pending) == 0:
+            return []
+
+        # Whatever is left is either part of a loop or uses an item that is. Each loop is its own strongly connected component, so separate loops are reported separately.
+        loops = self.find_loops_in(pending)
+        item_loops: Dict[str, List[str]] = {}
+        loop_stack: List[str] = []
+
+        for loop in loops:
+            for member in loop:
+                item_loops[member] = loop
+                loop_stack.append(member)
+
+        # Loops that were found earlier are reported again for the items that use them
+        for name in pending:
+            if name not in item_loops:
+                for input_stack in self.recipes[name].inputs:
+                    if input_stack.name in self.loop_errors:
+                        item_loops[name] = self.loop_errors[input_stack.name]
+                        loop_stack.append(name)
+                        break
+
+        # Every other item left over uses one of those loops, and reports the first one that reaches it
+        while len(loop_stack) > 0:
+            current = loop_stack.pop()
+
+            for consumer in self.consumers.get(current, ()):
+                if consumer in pending and consumer not in item_loops:
+                    item_loops[consumer] = item_loops[current]
+                    loop_stack.append(consumer)
+
+        for name in pending:
+            self.loop_errors[name] = item_loops[name]
+
+        return loops
 
     def get_recipe_item_types(self, item: str) -> Set[str]:
         """Gets a set of the types of items used in the recipe for an item."""
@@ -139,33 +405,41 @@ class PackConfigFile:
         else:
             return recipe.get_item_types()
 
-    def get_raw_materials(self) -> Set[str]:
-        """Returns the set containing all raw materials in the pack."""
-        return self.get_recipe_item_types("materials")
+    def get_special_item_list(self, key: str) -> Dict[str, None]:
+        """Gets the ordered set of items stored under one of the SPECIAL_ITEM_LISTS keys."""
+        return self.raw_materials if key == "materials" else self.ae2_fluids
+
+    def get_special_item_lists_iterable(self) -> Iterator[Tuple[str, Dict[str, None]]]:
+        """Returns a key/value (key in the pack file, ordered set of items) iterable for the raw materials and AE2 fluids, skipping empty lists."""
+        return iter([(key, self.get_special_item_list(key)) for key in SPECIAL_ITEM_LISTS if len(self.get_special_item_list(key)) > 0])
+
+    def get_raw_materials(self) -> KeysView[str]:
+        """Returns a set-like view of all raw materials in the pack."""
+        return self.raw_materials.keys()
 
     def add_raw_material(self, material: str):
         """Adds a raw material to the pack."""
-        recipe = self.get_recipe("materials")
-        
-        if recipe is None: # it may have to create the list of materials
-            self.set_recipe("materials", CraftingRecipe("materials", [ItemStack(material)]))
-        else:
-            # We add the new itemstack to the end of the recipe
-            self.set_recipe("materials", CraftingRecipe("materials", recipe.inputs + [ItemStack(material)]))
+        self.raw_materials[sys.intern(material)] = None
+        self.dirty_items.add("materials")
+
+    def remove_raw_material(self, material: str):
+        """Removes a raw material from the pack, if it is one."""
+        self.raw_materials.pop(material, None)
+        self.dirty_items.add("materials")
 
-    def get_ae2_fluids(self) -> Set[str]:
-        """Returns the set containing all AE2 fluids in the pack."""
-        return self.get_recipe_item_types("ae2_fluids")
+    def get_ae2_fluids(self) -> KeysView[str]:
+        """Returns a set-like view of all AE2 fluids in the pack."""
+        return self.ae2_fluids.keys()
     
     def add_ae2_fluid(self, fluid: str):
         """Adds an AE2 fluid to the pack."""
-        recipe = self.get_recipe("ae2_fluids")
-        
-        if recipe is None: # it may have to create the list of materials
-            self.set_recipe("ae2_fluids", CraftingRecipe("ae2_fluids", [ItemStack(fluid)]))
-        else:
-            # We add the new itemstack to the end of the recipe
-            self.set_recipe("ae2_fluids", CraftingRecipe("ae2_fluids", recipe.inputs + [ItemStack(fluid)]))
+        self.ae2_fluids[sys.intern(fluid)] = None
+        self.dirty_items.add("ae2_fluids")
+
+    def remove_ae2_fluid(self, fluid: str):
+        """Removes an AE2 fluid from the pack, if it is one."""
+        self.ae2_fluids.pop(fluid, None)
+        self.dirty_items.add("ae2_fluids")
 
     def get_recipes_iterable(self) -> Iterator[Tuple[str, "CraftingRecipe"]]:
         """Returns a key/value (item_name, recipe) iterable for all of the recipes in the pack."""
@@ -180,43 +454,443 @@ class PackConfigFile:
         for item, recipe in addon.get_recipes_iterable():
             self.set_recipe(item, recipe)
 
-    def get_recipe_depth(self, item: str):
-        """Gets the depth of the recipe for an item, if it exists. If the recipe does not exist, it returns 0."""
-        recipe = self.get_recipe(item)
-        
-        if recipe is None:
+        # Like recipes, an addon's raw materials or fluids replace the pack's
+        for key, items in addon.get_special_item_lists_iterable():
+            item_list = self.get_special_item_list(key)
+            item_list.clear()
+            item_list.update(items)
+
+            self.dirty_items.add(key)
+
+    def with_addons(self, addons: List["PackConfigFile"]) -> "PackConfigFile":
+        """Returns a new pack made of this pack with the addons layered on top, the same as extending a freshly loaded copy of this pack with each addon, but without reloading or changing this pack.
+
+        The new pack's indexes start out as shallow copies of this pack's dicts, which Python copies in bulk without visiting the entries one by one, so lookups stay O(1) dict lookups. Recipes and consumer sets are shared instead of copied (consumer sets are only copied when an addon changes them), and the depths, loop errors and raw material closures this pack already worked out are kept for every item the addons don't affect."""
+        pack = PackConfigFile(None)
+
+        pack.recipes = dict(self.recipes)
+        pack.consumers = collections.defaultdict(set, self.consumers)
+        pack.borrowed_consumers = set(self.consumers)
+        pack.depths = dict(self.depths)
+        pack.loop_errors = dict(self.loop_errors)
+        pack.item_ids = dict(self.item_ids)
+        pack.item_names = list(self.item_names)
+        pack.raw_material_closures = dict(self.raw_material_closures)
+        pack.shared_inputs = dict(self.shared_inputs)
+        pack.shared_input_users = dict(self.shared_input_users)
+        pack.raw_materials = dict(self.raw_materials)
+        pack.ae2_fluids = dict(self.ae2_fluids)
+        pack.special_list_positions = dict(self.special_list_positions)
+
+        # set_recipe invalidates only the cached state that depends on the recipes the addons replace or add
+        for addon in addons:
+            pack.extend_pack(addon)
+
+        return pack
+
+    def find_loops_in(self, items: Collection[str]) -> List[List[str]]:
+        """Finds the recipe loops made up only of the given craftable items, using an iterative version of Tarjan's strongly connected components algorithm. Each loop is a sorted list of the items in it."""
+        index: Dict[str, int] = {}
+        lowlink: Dict[str, int] = {}
+        on_stack: Set[str] = set()
+        component_stack: List[str] = []
+        loops: List[List[str]] = []
+
+        for root in items:
+            if root in index:
+                continue
+
+            # Each frame is an item along with an iterator over the craftable items used in its recipe
+            frames: List[Tuple[str, Iterator[str]]] = [(root, iter([stack.name for stack in self.recipes[root].inputs if stack.name in items]))]
+            index[root] = lowlink[root] = len(index)
+            component_stack.append(root)
+            on_stack.add(root)
+
+            while len(frames) > 0:
+                item, inputs = frames[-1]
+                next_input = next(inputs, None)
+
+                if next_input is not None:
+                    if next_input not in index:
+                        index[next_input] = lowlink[next_input] = len(index)
+                        component_stack.append(next_input)
+                        on_stack.add(next_input)
+                        frames.append((next_input, iter([stack.name for stack in self.recipes[next_input].inputs if stack.name in items])))
+                    elif next_input in on_stack:
+                        lowlink[item] = min(lowlink[item], index[next_input])
+
+                    continue
+
+                # Every input has been visited, so the item is finished
+                frames.pop()
+
+                if len(frames) > 0:
+                    parent = frames[-1][0]
+                    lowlink[parent] = min(lowlink[parent], lowlink[item])
+
+                if lowlink[item] == index[item]:
+                    component: List[str] = []
+
+                    while True:
+                        member = component_stack.pop()
+                        on_stack.discard(member)
+                        component.append(member)
+
+                        if member == item:
+                            break
+
+                    # A single item is only a loop if its recipe uses itself
+                    if len(component) > 1 or item in self.recipes[item].get_item_types():
+                        loops.append(sorted(component))
+
+        return loops
+
+    def find_recipe_loops(self) -> List[List[str]]:
+        """Finds every recipe loop in the pack. Each loop is a sorted list of the items in it, and the loops are sorted as well. Loops are read from the depth cache, so after an edit only the items that the edit invalidated are looked at again."""
+        self.compute_depths()
+
+        # Every member of a loop maps to that loop, while items that only use a loop map to a loop they aren't in
+        loops: Dict[Tuple[str, ...], List[str]] = {}
+
+        for item, loop in self.loop_errors.items():
+            if item in loop:
+                loops[tuple(loop)] = loop
+
+        return sorted(loops.values())
+
+    def get_recipe_loop(self, item: str) -> Optional[List[str]]:
+        """Returns the items in the recipe loop that an item is part of (or uses), or None if the item isn't affected by any recipe loop."""
+        if item not in self.recipes:
+            return None
+
+        if item not in self.depths and item not in self.loop_errors:
+            self.compute_depths([item])
+
+        return self.loop_errors.get(item)
+
+    def get_recipe_depth(self, item: str) -> int:
+        """Gets the depth of the recipe for an item, if it exists. If the recipe does not exist, it returns 0. Depths are calculated as needed and cached, and a RecipeLoopError is raised if the item is part of (or uses) a recipe loop."""
+        if item in self.depths:
+            if self.counters is not None:
+                self.counters.depth_cache_hits += 1
+
+            return self.depths[item]
+
+        if item not in self.recipes:
             return 0
-        else:
-            return recipe.depth
 
+        if self.counters is not None:
+            self.counters.depth_cache_misses += 1
+
+        if item not in self.loop_errors:
+            self.compute_depths([item])
+
+        if item in self.loop_errors:
+            raise RecipeLoopError(item, self.loop_errors[item])
+
+        return self.depths[item]
+
+    def get_item_id(self, item: str) -> int:
+        """Gets the interned id of an item, giving it a new id if it doesn't have one yet."""
+        item_id = self.item_ids.get(item)
+
+        if item_id is None:
+            item_id = len(self.item_names)
+            self.item_ids[item] = item_id
+            self.item_names.append(item)
+
+        return item_id
+
+    def get_raw_material_closure(self, item: str) -> int:
+        """Gets the raw materials used to craft an item as a bitset over item_ids. Closures are cached, and after a recipe changes only the items using it have to be calculated again. Raises a RecipeLoopError if the item is part of (or uses) a recipe loop."""
+        if item in self.raw_material_closures:
+            return self.raw_material_closures[item]
+
+        if item not in self.recipes:
+            return 1 << self.get_item_id(item)
+
+        # Makes sure the item isn't stuck behind a recipe loop, since the walk below would never finish
+        self.get_recipe_depth(item)
+
+        stack = [item]
+
+        while len(stack) > 0:
+            current = stack[-1]
+
+            if current in self.raw_material_closures:
+                stack.pop()
+                continue
+
+            inputs = self.recipes[current].inputs
+
+            # Inputs without a cached closure are calculated first
+            missing = [input_stack.name for input_stack in inputs if input_stack.name in self.recipes and input_stack.name not in self.raw_material_closures]
+
+            if len(missing) > 0:
+                stack.extend(missing)
+                continue
+
+            closure = 0
+
+            for input_stack in inputs:
+                if input_stack.name in self.recipes:
+                    closure |= self.raw_material_closures[input_stack.name]
+                else:
+                    closure |= 1 << self.get_item_id(input_stack.name)
+
+            self.raw_material_closures[current] = closure
+            stack.pop()
+
+        return self.raw_material_closures[item]
+
+    def get_all_raw_materials(self, item: str) -> Set[str]:
+        """Gets the set of all the raw materials (items without recipes) used to craft an item, using the cached closures. Raises a RecipeLoopError if the item is part of (or uses) a recipe loop."""
+        closure = self.get_raw_material_closure(item)
+        result: Set[str] = set()
+
+        while closure:
+            # Takes the lowest set bit each time
+            lowest = closure & -closure
+            result.add(self.item_names[lowest.bit_length() - 1])
+            closure ^= lowest
+
+        return result
+
+
+def get_journal_path(path: str) -> str:
+    """Gets the path of the edit journal for a pack, which is kept next to the pack file."""
+    return path + ".journal"
+
+
+def apply_journal_entry(pack: PackConfigFile, entry: YAML_Data):
+    """Applies one edit from a pack's journal to the pack. The entries are written by calchelper.PackJournal."""
+    op = entry["op"]
+
+    if op == "set":
+        pack.set_recipe(entry["item"], CraftingRecipe(entry["item"], [make_item_stack(item) for item in entry["items"]], entry["produces"]))
+    elif op == "delete":
+        if pack.has_recipe(entry["item"]):
+            pack.delete_recipe(entry["item"])
+    elif op == "add_material":
+        pack.add_raw_material(entry["item"])
+    elif op == "remove_material":
+        pack.remove_raw_material(entry["item"])
+    elif op == "add_fluid":
+        pack.add_ae2_fluid(entry["item"])
+    elif op == "remove_fluid":
+        pack.remove_ae2_fluid(entry["item"])
+
+
+def repair_journal(journal_path: str) -> int:
+    """Cuts a broken last entry (left behind if the program stopped while writing it) off the end of a journal, so new entries don't get appended to it. Returns how many bytes were removed."""
+    if not os.path.exists(journal_path):
+        return 0
+
+    with open(journal_path, "rb+") as file:
+        data = file.read()
+
+        # Every finished entry ends with a newline, so anything after the last one was never finished
+        end = data.rfind(b"\n") + 1
+
+        if end < len(data):
+            file.truncate(end)
+            file.flush()
+            os.fsync(file.fileno())
+
+    return len(data) - end
+
+
+def replay_pack_journal(pack: PackConfigFile, path: str) -> int:
+    """Replays the edits in a pack's journal (if it has one) that haven't been saved into the pack file yet, returning how many edits were replayed. Broken entries are reported and skipped, so they can't hide the edits after them."""
+    journal_path = get_journal_path(path)
+
+    if not os.path.exists(journal_path):
+        return 0
+
+    count = 0
+
+    with open(journal_path, "r", encoding="utf-8") as file:
+        for number, line in enumerate(file, 1):
+            try:
+                entry = json.loads(line)
+                apply_journal_entry(pack, entry)
+            except (ValueError, KeyError, TypeError, AttributeError) as e:
+                print(f"Skipping broken entry on line {number} of {journal_path}: {e!r}")
+                continue
+
+            count += 1
+
+    return count
+
+
+PACK_KEY_PATTERN = re.compile(r"([^ ].*):")
+"""Matches the line starting an entry in a pack file, as written by save_data."""
+
+PACK_PRODUCES_PATTERN = re.compile(r"    produces: (0|[1-9][0-9]*)")
+"""Matches the "produces" line of a recipe in a pack file. Other ways of writing numbers (like 0x10) are left to the YAML loader."""
+
+PACK_ITEM_PATTERN = re.compile(r"        - ([^ ].*)")
+"""Matches an item line of an entry in a pack file."""
+
+PACK_SCALAR_RESOLVER = yaml.resolver.Resolver()
+"""Used to check that a plain scalar would be loaded as a string by the YAML loader, and not as a number, bool or null."""
+
+
+def is_plain_string(value: str) -> bool:
+    """Returns if the YAML loader would load the text as the same string it is written as. Anything with quoting, comments, special characters or surrounding whitespace is rejected, even if it might be fine."""
+    if value != value.strip() or value[0] in "-?:,[]{}#&*!|>'\"%@`\ufeff" or ": " in value or " #" in value or value.endswith(":"):
+        return False
+
+    # Tabs and control characters make YAML unhappy, so they are left to the full loader as well
+    if not value.isprintable():
+        return False
+
+    return PACK_SCALAR_RESOLVER.resolve(yaml.ScalarNode, value, (True, False)) == "tag:yaml.org,2002:str"
+
+
+def parse_pack_file(path: str) -> Optional[PackConfigFile]:
+    """Parses a pack file written in the fixed layout used by save_data, building the recipes line by line instead of loading the whole file as a YAML document first. This halves the peak memory of loading big packs and is much faster.
+
+    Returns None if the file uses anything else (comments, quoting, flow style, different indentation, repeated entries, values that aren't strings...), in which case the file should be loaded with the YAML loader instead."""
+    pack = PackConfigFile(None)
+    seen: Set[str] = set()
+
+    key: Optional[str] = None
+    produces = 1
+    items: List[str] = []
+    in_items = False
+
+    with open(path, "r") as file:
+        for line in file:
+            line = line.rstrip("\n")
+
+            if line == "":
+                continue
+
+            item_match = PACK_ITEM_PATTERN.fullmatch(line)
+
+            if item_match is not None:
+                if not in_items or not is_plain_string(item_match.group(1)):
+                    return None
+
+                items.append(item_match.group(1))
+                continue
+
+            produces_match = PACK_PRODUCES_PATTERN.fullmatch(line)
+
+            if produces_match is not None:
+                # "produces" has to come right after the key
+                if key is None or in_items or produces != 1:
+                    return None
+
+                produces = int(produces_match.group(1))
+                continue
+
+            if line == "    items:":
+                if key is None or in_items:
+                    return None
+
+                in_items = True
+                continue
+
+            key_match = PACK_KEY_PATTERN.fullmatch(line)
+
+            if key_match is None or not is_plain_string(key_match.group(1)) or key_match.group(1) in seen:
+                return None
+
+            # A new entry starts, so the previous one is finished
+            if key is not None:
+                if not in_items or len(items) == 0:
+                    return None
+
+                pack.add_entry(key, items, produces)
+
+            key = key_match.group(1)
+            seen.add(key)
+            produces = 1
+            items = []
+            in_items = False
+
+    if key is not None:
+        # An empty list of items loads as null, which the YAML path deals with
+        if not in_items or len(items) == 0:
+            return None
+
+        pack.add_entry(key, items, produces)
+
+    return pack
+
+
+def load_pack_file(path: str) -> PackConfigFile:
+    """Loads a pack file into a new PackConfigFile, without replaying its journal. Files in the layout written by save_data are parsed directly, anything else goes through the YAML loader. If the file doesn't exist yet, it creates a blank file."""
+    if os.path.exists(path):
+        pack = parse_pack_file(path)
+
+        if pack is not None:
+            return pack
 
-def load_pack_config(path: str) -> PackConfigFile:
-    """Loads a pack config file from the path provided, creating a new PackConfigFile instance. If the file doesn't exist yet, it creates a blank file."""
     return PackConfigFile(load_config_file(path, True))
 
 
+def load_pack_config(path: str) -> PackConfigFile:
+    """Loads a pack config file from the path provided, creating a new PackConfigFile instance. If the file doesn't exist yet, it creates a blank file. Edits in the pack's journal that weren't saved yet are replayed on top of the file."""
+    pack = load_pack_file(path)
+
+    # The pack matches the file until the journal is replayed on top of it
+    pack.mark_saved(path)
+
+    replay_pack_journal(pack, path)
+
+    # Work out depths and find any recipe loops right away, so loops can be flagged without recursing into them
+    pack.compute_depths()
+
+    return pack
+
+
+def print_recipe_loops(pack: PackConfigFile):
+    """Prints a warning for every recipe loop in the pack."""
+    for loop in pack.find_recipe_loops():
+        print(f"Recipe loop found with items {loop}")
+
+
+RecipeInputs = Tuple["ItemStack", ...]
+"""Type of the inputs of a CraftingRecipe. Inputs are shared between the recipes of a pack (see PackConfigFile.share_recipe_inputs), so they are stored as tuples to stop them from being changed in place."""
+
+RecipeInputsKey = Tuple[Tuple[str, int], ...]
+"""(name, amount) for each input of a recipe, used to find recipes with the same inputs."""
+
+
+def merge_recipe_inputs(inputs: Iterable["ItemStack"]) -> RecipeInputs:
+    """Merges duplicate items in a list of inputs, returning a tuple of ItemStacks for the merged inputs."""
+    # Create a dictionary to count up how much each item appears
+    inputs_dict: Dict[str, int] = collections.defaultdict(int)
+
+    # it does some processing for the inputs to add together cases where it calls for the same item twice
+    for stack in inputs:
+        inputs_dict[stack.name] += stack.amount
+
+    # Item names are interned so every recipe using an item shares the same string
+    return tuple([ItemStack(sys.intern(name), amount) for name, amount in inputs_dict.items()])
+
+
+def get_recipe_inputs_key(inputs: RecipeInputs) -> RecipeInputsKey:
+    """Gets the key used to share the inputs of recipes."""
+    return tuple([(stack.name, stack.amount) for stack in inputs])
+
+
 class CraftingRecipe:
     """Class representing a crafting recipe for the cost calculator to use."""
+    __slots__ = ("output", "amount_produced", "inputs", "depth")
+
     def __init__(self, output: str, inputs: List["ItemStack"], amount_produced: int=1):
-        self.output = output
+        self.output = sys.intern(output)
         """What type of item does the recipe produce?"""
         
         self.amount_produced = amount_produced
         """How many of that item does the recipe produce? (defaults to 1)"""
 
-        self.inputs: List[ItemStack] = []
-        """List of items (as an ItemStack) used for the recipe."""
-
-        # Create a dictionary to count up how much each item appears
-        inputs_dict: Dict[str, int] = collections.defaultdict(int)
-
-        # it does some processing for the inputs to add together cases where it calls for the same item twice
-        for stack in inputs:
-            inputs_dict[stack.name] += stack.amount
-
-        # Now iterate over each entry in the defaultdict to create the new ItemStacks
-        for name, amount in inputs_dict.items():
-            self.inputs.append(ItemStack(name, amount))
+        self.inputs: RecipeInputs = merge_recipe_inputs(inputs)
+        """Items (as ItemStacks) used for the recipe. Duplicate items are merged together. The ItemStacks may be shared with other recipes once the recipe is added to a pack, so they must not be changed."""
 
         # Just set the depth to 0 for now.
         self.depth = 0
@@ -245,6 +919,9 @@ class CraftingRecipe:
 
 class ItemStack:
     """The ItemStack class represents a stack of items for calculation, which has an item name and an amount."""
+    # Millions of ItemStacks can be created for big orders, so they don't get a __dict__
+    __slots__ = ("name", "amount", "depth")
+
     def __init__(self, name: str, amount: int=1, depth: int=0):
         self.name = name
         """What item the ItemStack represents."""
@@ -268,138 +945,89 @@ def make_item_stack(string: str) -> ItemStack:
     amount = first_word(string)
 
     if amount.isnumeric():
-        return ItemStack(get_remaining_words(string), int(amount))
+        return ItemStack(sys.intern(get_remaining_words(string)), int(amount))
     else:
-        return ItemStack(string, 1)
+        return ItemStack(sys.intern(string), 1)
     
  
-@dataclass   
-class TrieNode:
-    """The TrieNode class represents a node in a Trie."""
-    amount: int
-    """How many times has the character appeared in this position?"""
-    
-    next: Optional["Trie"]
-    """What Trie does this node point to?"""
-
-
 class Trie:
-    dictionary: set[str] = set()
-    """Dictionary of valid words."""
-    
-    """The Trie class lets you build an auto-complete system by storing how characters map to how many times they appear."""
+    """The Trie class lets you build an auto-complete system from words and how many times they appear.
+
+    Nodes are stored in flat lists indexed by node number (node 0 is the root) instead of as nested objects, and every node caches its best completion, so predictions only have to walk the prefix."""
     def __init__(self):
-        # it will have a dict of characters which map to the amount of times that character appeared in that position, as well as either another Trie or None
-        self.characters: Dict[str, TrieNode] = {}
-        """The characters dict maps a character to a TrieNode."""
+        self.children: List[Dict[str, int]] = [{}]
+        """Maps each node to a dict of the characters following it and the nodes they lead to."""
+
+        self.best: List[str] = [""]
+        """Best completion for each node: the word starting with the node's prefix that was added the most times. Ties go to the shorter word, then the word that comes first alphabetically."""
+
+        self.dictionary: Dict[str, int] = {}
+        """Dictionary of valid words in this Trie, mapped to how many times they were added."""
 
         self.total_words = 0
         """How many total words were added to this Trie? Can apply to duplicates."""
 
+    def is_better_completion(self, word: str, other: str) -> bool:
+        """Returns if a word makes a better completion than another word."""
+        return (-self.dictionary[word], len(word), word) < (-self.dictionary[other], len(other), other)
+
     def add_word(self, word: str, multiplier: int=1):
         """Adds a word to the Trie. The optional multiplier parameter determines how many times the word should be added."""
-        Trie.dictionary.add(word)
-
-        # this is recursive and uses multiple tries, so we start with the base case
-        ch = word[0]
+        if len(word) == 0:
+            return
 
+        self.dictionary[word] = self.dictionary.get(word, 0) + multiplier
         self.total_words += multiplier
 
-        if len(word) == 1:
-            if ch in self.characters:
-                current = self.characters[ch]
-                self.characters[ch] = TrieNode(current.amount + multiplier, current.next)
-            else:
-                self.characters[ch] = TrieNode(multiplier, None)
-        else:
-            if ch in self.characters:
-                current = self.characters[ch]
-                
-                new_trie = Trie() if current.next is None else current.next
-                
-                # The function is called recursively with the rest of the word
-                new_trie.add_word(word[1:], multiplier)
-                
-                self.characters[ch] = TrieNode(
-                    current.amount + multiplier,
-                    new_trie
-                )
-            else:
-                new_trie = Trie()
-                new_trie.add_word(word[1:], multiplier)
-                
-                self.characters[ch] = TrieNode(multiplier, new_trie)
-
-    # This now attempts to predict a word based on the given text (use the amount of words, track the number of times this word has appeared too, words represents the set of words, current represents the current string)
-    def predict_word(self, word: str, num_words: int=-1, current: str="", starting_word: Optional[str]=None) -> str:
-        """Predicts a word from the Trie based on the characters provided so far.
-        
-        word refers to the characters provided so far.
-        
-        num_words refers to the number of total words in that part of the Trie, which can be passed as a parameter by recursive calls.
-        
-        words refers to the set of words in whichever Trie was originally used to call this function.
-        
-        current refers to the current word being constructed. It is used to predict a word, especially after the initial word is consumed.
-        
-        starting_word refers to what word was originally passed into the function."""
-        # Get the number of total words. It can either be passed as a parameter or can just be the total_words value.
-        num_words = num_words if num_words >= 0 else self.total_words
-        
-        # Gets the starting word to work with. By default, it will be the word which is passed here.
-        start = word if starting_word is None else starting_word
+        node = 0
 
-        # This is the case where the word passed into the method is empty. This would be the base case.
-        if len(word) == 0:
-            # Find which of the characters corresponds to the TrieNode with the largest value.
-            max_char, max_char_node = max(self.characters.items(), key=lambda ch_entry: ch_entry[1].amount)
-            max_char_amt = max_char_node.amount
-
-            # The current word passed in to this method is a word and the TrieNode corresponding to the character which appears the most is responsible for at least half of all words in this Trie.
-            # For example, if that TrieNode had a value of 5, compared to 8 total words in this Trie, then this condition would be true.
-            if current in Trie.dictionary and max_char_amt <= num_words - max_char_amt:
-                # We found the starting word, so continue predicting from there.
-                if current == start:
-                    next_node = max_char_node.next
-                    
-                    # Python doesn't have a null coalescing operator, so just check if it is None
-                    if next_node is None: # next_node shouldn't be None, but just return an empty string in case
-                        return ""
-                    else:
-                        return max_char + next_node.predict_word(word, max_char_amt, current=current + max_char, starting_word=start)
-                else:
-                    # We found a word which makes up the majority of the words at this part of the Trie, so don't return any more characters and let the function calls higher up return the word.
-                    return ""
-            # The character that appears the most doesn't have any Trie connected to it, so just return that character
-            elif max_char_node.next is None:
-                return max_char
-            else:
-                # Standard recursive case
-                return max_char + max_char_node.next.predict_word(word, max_char_amt, current=current + max_char, starting_word=start)
-
-        # We need to work with the first character of the word
-        ch = word[0]
-
-        # There are no words in the Trie which this word can be used to make.
-        if ch not in self.characters:
-            return ""
-        else:
-            current_node = self.characters[ch]
-            
-            # The current node does not have any more words, so just predict that character
-            if current_node.next is None:
-                return ch
+        # Counts only go up, so the word can only replace the best completions along its own path
+        if self.best[node] == "" or self.is_better_completion(word, self.best[node]):
+            self.best[node] = word
+
+        for ch in word:
+            child = self.children[node].get(ch)
+
+            if child is None:
+                child = len(self.children)
+
+                # The new node is filled in before it is linked, so a reader walking the Trie never reaches a node that doesn't exist yet
+                self.children.append({})
+                self.best.append(word)
+                self.children[node][ch] = child
+            elif self.is_better_completion(word, self.best[child]):
+                self.best[child] = word
+
+            node = child
+
+    def predict_word(self, word: str) -> str:
+        """Predicts a word from the Trie based on the characters provided so far, returning the whole predicted word. Returns an empty string if no word in the Trie starts with those characters."""
+        node = 0
 
-            # Predict the next word using the Trie connected to the character's node, passing all but the first character of the current word that was passed into the function.
-            nxt = current_node.next.predict_word(word[1:], current_node.amount, current=current + ch, starting_word=start)
+        for ch in word:
+            child = self.children[node].get(ch)
 
-            # Case where the function could not predict a word
-            if nxt == "":
+            if child is None:
                 return ""
-            else:
-                # Case where it could predict a word, just return the new string.
-                return ch + nxt
-            
+
+            node = child
+
+        return self.best[node]
+
+    def to_data(self) -> Dict[str, Any]:
+        """Converts the Trie to plain lists and dicts, which can be saved as JSON."""
+        return {"children": self.children, "best": self.best, "dictionary": self.dictionary, "total_words": self.total_words}
+
+    @staticmethod
+    def from_data(data: Dict[str, Any]) -> "Trie":
+        """Creates a Trie from the results of to_data, without adding the words again."""
+        trie = Trie()
+        trie.children = data["children"]
+        trie.best = data["best"]
+        trie.dictionary = data["dictionary"]
+        trie.total_words = data["total_words"]
+
+        return trie
+
     def __repr__(self) -> str:
-        # The __repr__ function does work recursively
-        return ", ".join([f"{k}: {v}" for k, v in self.characters.items()])
\ No newline at end of file
+        return ", ".join([f"{word}: {amount}" for word, amount in self.dictionary.items()])